@@ -2,11 +2,12 @@
 Forced Alignment with Whisper
 C. Max Bain
 """
+import functools
+import weakref
 from dataclasses import dataclass
 from typing import Iterable, Union, List
 
 import numpy as np
-import pandas as pd
 #import torch
 #import torchaudio
 from transformers import FlaxWav2Vec2ForCTC, Wav2Vec2Processor
@@ -77,7 +78,7 @@ class AlignedTranscriptionResult(TypedDict):
 import nltk
 from nltk.tokenize.punkt import PunktSentenceTokenizer, PunktParameters
 
-#SAMPLE_RATE = 16000
+SAMPLE_RATE = 16000
 PUNKT_ABBREVIATIONS = ['dr', 'vs', 'mr', 'mrs', 'prof']
 
 LANGUAGES_WITHOUT_SPACES = ["ja", "zh"]
@@ -126,11 +127,88 @@ DEFAULT_ALIGN_MODELS_HF = {
     "es": "jonatasgrosman/wav2vec2-large-xlsr-53-spanish",
 }
 
+# lengths in seconds the segments are padded to before the alignment model, one compiled executable per bucket
+EMISSION_BUCKETS = (4, 8, 16, 32)
+
+# model -> (mesh, jitted emission function, params replicated on the mesh), kept as long as the model is alive
+_emission_functions = weakref.WeakKeyDictionary()
+
+def get_emission_function(model, mesh):
+    """
+    Returns the jitted log-probabilities of the alignment `model` and its params replicated on the devices of `mesh`.
+    Both are created once per model, so the emission function is compiled once per (batch size, length bucket)
+    instead of once per batch, and the params are uploaded once.
+    """
+    cached = _emission_functions.get(model)
+    if cached is not None and cached[0] is mesh:
+        return cached[1], cached[2]
+
+    x_sharding = NamedSharding(mesh, PartitionSpec("data"))
+    replicate_sharding = NamedSharding(mesh, PartitionSpec(None))
+    # only the module is captured, such that the cache does not keep the model alive
+    module = model.module
+    # models with a layer-normalised feature encoder are trained with an attention mask, which makes their outputs
+    # independent of the padding of the bucket; models with a group-normalised one are not and only see zero-padding
+    use_attention_mask = model.config.feat_extract_norm == "layer"
+
+    def emissions(params, waveforms, attention_mask):
+        logits = module.apply(
+            {"params": params},
+            waveforms,
+            attention_mask if use_attention_mask else jnp.ones_like(attention_mask),
+            return_dict=True,
+        ).logits
+        return jnp.log(jax.nn.softmax(logits, axis=-1))
+
+    emission_function = jax.jit(
+        emissions, in_shardings=(replicate_sharding, x_sharding, x_sharding), out_shardings=x_sharding
+    )
+    params = jax.device_put(model.params, replicate_sharding)
+    _emission_functions[model] = (mesh, emission_function, params)
+    return emission_function, params
+
+def get_emission_bucket(num_samples):
+    """The padded length of a segment of `num_samples`: the smallest bucket holding it, or a multiple of the largest."""
+    for bucket in EMISSION_BUCKETS:
+        if num_samples <= bucket * SAMPLE_RATE:
+            return bucket * SAMPLE_RATE
+    largest = EMISSION_BUCKETS[-1] * SAMPLE_RATE
+    return -(-num_samples // largest) * largest
+
 def interpolate_nans(x, method='nearest'):
-    if x.notnull().sum() > 1:
-        return x.interpolate(method=method).ffill().bfill()
-    else:
-        return x.ffill().bfill()
+    """
+    Fills the NaNs of a 1d array as pandas' `Series.interpolate(method).ffill().bfill()`: the NaNs between two values
+    are interpolated over their positions, the ones before the first (after the last) value take the first (last)
+    value.
+    """
+    x = np.array(x, dtype=np.float64)
+    valid = ~np.isnan(x)
+    positions = np.arange(len(x))
+    if valid.sum() > 1:
+        valid_positions = positions[valid]
+        inner = ~valid & (positions > valid_positions[0]) & (positions < valid_positions[-1])
+        if method == "nearest":
+            # as scipy's nearest interpolation, a NaN halfway between two values takes the first one
+            midpoints = (valid_positions[1:] + valid_positions[:-1]) / 2
+            nearest = np.searchsorted(midpoints, positions[inner], side="left")
+            x[inner] = x[valid_positions][nearest]
+        elif method == "linear":
+            x[inner] = np.interp(positions[inner], valid_positions, x[valid_positions])
+        else:
+            raise NotImplementedError(f"Interpolation method {method} not supported.")
+        valid = ~np.isnan(x)
+    if valid.any():
+        # forward fill, then backward fill the NaNs before the first value
+        last_valid = np.maximum.accumulate(np.where(valid, positions, 0))
+        x = np.where(positions < positions[valid][0], x[valid][0], x[last_valid])
+    return x
+
+@functools.lru_cache
+def get_sentence_splitter():
+    """The Punkt sentence splitter, built once instead of once per segment."""
+    punkt_param = PunktParameters()
+    punkt_param.abbrev_types = set(PUNKT_ABBREVIATIONS)
+    return PunktSentenceTokenizer(punkt_param)
 
 def load_align_model(language_code, model_name=None, model_dir=None):
     if model_name is None:
@@ -238,10 +316,7 @@ def align(
                 clean_wdx.append(wdx)
 
                 
-        punkt_param = PunktParameters()
-        punkt_param.abbrev_types = set(PUNKT_ABBREVIATIONS)
-        sentence_splitter = PunktSentenceTokenizer(punkt_param)
-        sentence_spans = list(sentence_splitter.span_tokenize(text))
+        sentence_spans = list(get_sentence_splitter().span_tokenize(text))
 
         segment["clean_char"] = clean_char
         segment["clean_cdx"] = clean_cdx
@@ -251,55 +326,53 @@ def align(
     aligned_segments: List[SingleAlignedSegment] = []
     
     
-    x_sharding = NamedSharding(mesh,PartitionSpec("data"))
     # 2. Get prediction matrix from alignment model & align
-    pre_emissions = []
-    pre_waveform_segments = []
-    pre_segment_lengths = []
-    def pad_and_stack_waveforms(waveforms, max_length):
-        """Pad a batch of waveforms to the same length and stack them."""
-        return np.concatenate([
-            np.pad(w, ((0, 0), (0, max_length - w.shape[-1]))) for w in waveforms
-        ],axis=0)
-    def slice_emissions(emissions, lengths):
-        """Slice emissions to match the original lengths of waveforms."""
-        return [np.asarray(emissions[i, :(l - 80)//320,:]) for i, l in enumerate(lengths)]
+    if model_type != "huggingface":
+        raise NotImplementedError(f"Align model of type {model_type} not supported.")
+    emission_function, params = get_emission_function(model, mesh)
+
+    blank_id = 0
+    for char, code in model_dictionary.items():
+        if char == '[pad]' or char == '<pad>':
+            blank_id = code
+
     BATCH_SIZE = 16
     import time
     CTC_time = time.time()
-    for sdx, segment in enumerate(transcript):
-        
-        t1 = segment["start"]
-        t2 = segment["end"]
-
-        f1 = t1#int(t1 * SAMPLE_RATE)
-        f2 = t2#int(t2 * SAMPLE_RATE)
-
-        waveform_segment = audio[:, f1:f2]
-        SAMPLE_RATE = 16000
-        MAX_LENGTH = 32 * SAMPLE_RATE
-        pre_waveform_segments.append(waveform_segment)
-        pre_segment_lengths.append(waveform_segment.shape[-1])
-        if len(pre_waveform_segments) == BATCH_SIZE or sdx == len(transcript) - 1:
+    # the segments are sorted into length buckets, so short segments do not pay for the compute of a 32s one
+    waveform_segments = [audio[0, segment["start"]:segment["end"]] for segment in transcript]
+    num_frames = [max(0, (waveform_segment.shape[-1] - 80) // 320) for waveform_segment in waveform_segments]
+    buckets = {}
+    for sdx, waveform_segment in enumerate(waveform_segments):
+        buckets.setdefault(get_emission_bucket(waveform_segment.shape[-1]), []).append(sdx)
+
+    # only the segments with characters in the dictionary, starting within the audio, are aligned
+    segment_tokens = [
+        [model_dictionary[c] for c in segment["clean_char"]] if segment["start"] < MAX_DURATION else []
+        for segment in transcript
+    ]
+    segment_char_segments = [None] * len(transcript)
+    for bucket_length, bucket_sdxs in sorted(buckets.items()):
+        for i in range(0, len(bucket_sdxs), BATCH_SIZE):
+            batch_sdxs = bucket_sdxs[i:i + BATCH_SIZE]
             # Pad and stack the waveforms to create a batch
-            waveform_segments_padded = pad_and_stack_waveforms(pre_waveform_segments, MAX_LENGTH)
-            lengths = np.asarray(pre_segment_lengths)
-            B_padding = BATCH_SIZE - waveform_segments_padded.shape[0]
-            waveform_segments_padded = np.pad(waveform_segments_padded,((0,B_padding),(0,0)))
-
-            if model_type == "huggingface":
-                def model_wrap(waveform_seg):
-                    return jnp.log(jax.nn.softmax(model(waveform_seg).logits,axis=-1))
-                emissions_batch = jax.jit(
-                model_wrap, in_shardings=x_sharding, out_shardings=x_sharding
-                )(waveform_segments_padded)
-            else:
-                raise NotImplementedError(f"Align model of type {model_type} not supported.")
-            emissions_batch = emissions_batch[:BATCH_SIZE-B_padding]
-            #emissions_batch = np.asarray(emissions_batch)
-            pre_emissions.extend(slice_emissions(emissions_batch, lengths))
-            pre_waveform_segments = []
-            pre_segment_lengths = []
+            waveform_segments_padded = np.zeros((BATCH_SIZE, bucket_length), dtype=np.float32)
+            attention_mask = np.zeros((BATCH_SIZE, bucket_length), dtype=np.int32)
+            for row, sdx in enumerate(batch_sdxs):
+                waveform_segments_padded[row, :waveform_segments[sdx].shape[-1]] = waveform_segments[sdx]
+                attention_mask[row, :waveform_segments[sdx].shape[-1]] = 1
+
+            # 3. Align with the batched CTC Viterbi: the emissions never leave the devices, only the frame spans and
+            # scores of the tokens are transferred to the host
+            emissions_batch = emission_function(params, waveform_segments_padded, attention_mask)
+            batch_char_segments = align_emissions_batch(
+                emissions_batch,
+                [segment_tokens[sdx] for sdx in batch_sdxs],
+                [num_frames[sdx] for sdx in batch_sdxs],
+                blank_id,
+            )
+            for sdx, char_segments in zip(batch_sdxs, batch_char_segments):
+                segment_char_segments[sdx] = char_segments
     count_CTC_time = time.time()
     print(f"CTC耗时:{count_CTC_time-CTC_time}")
 
@@ -330,122 +403,122 @@ def align(
             aligned_segments.append(aligned_seg)
             continue
 
-        text_clean = "".join(segment["clean_char"])
-        tokens = [model_dictionary[c] for c in text_clean]
-
-        emission = pre_emissions[sdx]
+        char_segments = segment_char_segments[sdx]
 
-        blank_id = 0
-        for char, code in model_dictionary.items():
-            if char == '[pad]' or char == '<pad>':
-                blank_id = code
-
-        trellis = get_trellis(emission, tokens, blank_id)
-        path = backtrack(trellis, emission, tokens, blank_id)
-
-        if path is None:
+        if char_segments is None:
             print(f'Failed to align segment ("{segment["text"]}"): backtrack failed, resorting to original...')
             aligned_segments.append(aligned_seg)
             continue
 
-        char_segments = merge_repeats(path, text_clean)
-
         duration = t2 -t1
-        ratio = duration * waveform_segment.shape[0] / (trellis.shape[0] - 1)
+        ratio = duration / num_frames[sdx]
+
+        # assign timestamps to aligned characters, NaN for the others
+        char_starts = np.full(len(text), np.nan)
+        char_ends = np.full(len(text), np.nan)
+        char_scores = np.full(len(text), np.nan)
+        clean_cdx = np.asarray(segment["clean_cdx"], dtype=np.int64)
+        char_starts[clean_cdx] = [round(char_seg.start * ratio + t1, 3) for char_seg in char_segments]
+        char_ends[clean_cdx] = [round(char_seg.end * ratio + t1, 3) for char_seg in char_segments]
+        char_scores[clean_cdx] = [round(char_seg.score, 3) for char_seg in char_segments]
+
+        is_space = np.array([char == " " for char in text])
+        # word index of each character, nltk word tokenization would probably be more robust here, but us space for now...
+        if model_lang in LANGUAGES_WITHOUT_SPACES:
+            word_idx = np.arange(len(text))
+        else:
+            # a word ends before a space, so the space belongs to the next word
+            word_idx = np.concatenate([[0], np.cumsum(np.append(is_space[1:], True))[:-1]])
+
+        # the characters of each sentence, from its start up to and including its end index
+        sentence_ranges = [(sstart, min(send + 1, len(text))) for sstart, send in segment["sentence_spans"]]
+        sentence_cdx = np.concatenate([np.arange(sstart, send) for sstart, send in sentence_ranges])
+        sentence_lengths = np.array([send - sstart for sstart, send in sentence_ranges])
+        sentence_offsets = np.cumsum(sentence_lengths) - sentence_lengths
+        sentence_ids = np.repeat(np.arange(len(sentence_ranges)), sentence_lengths)
+        sentence_starts = np.fmin.reduceat(char_starts[sentence_cdx], sentence_offsets)
+        # dont use space character for alignment
+        sentence_ends = np.fmax.reduceat(
+            np.where(is_space[sentence_cdx], np.nan, char_ends[sentence_cdx]), sentence_offsets
+        )
 
-        # assign timestamps to aligned characters
-        char_segments_arr = []
-        word_idx = 0
-        for cdx, char in enumerate(text):
-            start, end, score = None, None, None
-            if cdx in segment["clean_cdx"]:
-                char_seg = char_segments[segment["clean_cdx"].index(cdx)]
-                start = round(char_seg.start * ratio + t1, 3)
-                end = round(char_seg.end * ratio + t1, 3)
-                score = round(char_seg.score, 3)
-
-            char_segments_arr.append(
-                {
-                    "char": char,
-                    "start": start,
-                    "end": end,
-                    "score": score,
-                    "word-idx": word_idx,
-                }
+        # the words of a sentence are the runs of characters with the same word index
+        new_word = np.ones(len(sentence_cdx), dtype=bool)
+        new_word[1:] = (np.diff(word_idx[sentence_cdx]) != 0) | (np.diff(sentence_ids) != 0)
+        word_offsets = np.flatnonzero(new_word)
+        word_bounds = np.append(word_offsets, len(sentence_cdx))
+        word_texts = [
+            text[sentence_cdx[wstart]:sentence_cdx[wend - 1] + 1].strip()
+            for wstart, wend in zip(word_bounds[:-1], word_bounds[1:])
+        ]
+        kept_words = np.array([len(word_text) > 0 for word_text in word_texts])
+        # the word reductions only run over the characters of the kept words that are not spaces
+        word_chars = kept_words[np.cumsum(new_word) - 1] & ~is_space[sentence_cdx]
+        kept_offsets = (np.cumsum(word_chars) - word_chars)[word_offsets[kept_words]]
+        kept_cdx = sentence_cdx[word_chars]
+        word_starts = np.fmin.reduceat(char_starts[kept_cdx], kept_offsets) if len(kept_cdx) else []
+        word_ends = np.fmax.reduceat(char_ends[kept_cdx], kept_offsets) if len(kept_cdx) else []
+        # the scores are float32, and the word scores were averaged in float32 too when no character was missing
+        score_dtype = np.float32 if len(clean_cdx) == len(text) else np.float64
+        word_scores = char_scores[kept_cdx].astype(score_dtype)
+        if len(kept_cdx):
+            word_counts = np.add.reduceat(~np.isnan(word_scores), kept_offsets).astype(score_dtype)
+            word_sums = np.add.reduceat(np.nan_to_num(word_scores), kept_offsets)
+            word_scores = np.where(word_counts > 0, word_sums / np.maximum(word_counts, 1), np.nan).astype(score_dtype)
+
+        sentence_words = [[] for _ in sentence_ranges]
+        kept_word_ids = np.flatnonzero(kept_words)
+        for wdx, word_start, word_end, word_score in zip(kept_word_ids, word_starts, word_ends, word_scores):
+            word_score = round(word_score, 3)
+            # -1 indicates unalignable 
+            word_segment = {"word": word_texts[wdx]}
+
+            if not np.isnan(word_start):
+                word_segment["start"] = word_start
+            if not np.isnan(word_end):
+                word_segment["end"] = word_end
+            if not np.isnan(word_score):
+                word_segment["score"] = word_score
+
+            sentence_words[sentence_ids[word_offsets[wdx]]].append(word_segment)
+
+        sentence_starts = interpolate_nans(sentence_starts, method=interpolate_method)
+        sentence_ends = interpolate_nans(sentence_ends, method=interpolate_method)
+
+        # concatenate sentences with same timestamps, in the order of their timestamps
+        aligned_subsegments = {}
+        for sentence_id in np.lexsort((sentence_ends, sentence_starts)).tolist():
+            sentence_start, sentence_end = float(sentence_starts[sentence_id]), float(sentence_ends[sentence_id])
+            if np.isnan(sentence_start) or np.isnan(sentence_end):
+                continue
+            sstart, send = segment["sentence_spans"][sentence_id]
+            subsegment = aligned_subsegments.setdefault(
+                (sentence_start, sentence_end),
+                {"start": sentence_start, "end": sentence_end, "text": [], "words": []},
             )
-
-            # increment word_idx, nltk word tokenization would probably be more robust here, but us space for now...
-            if model_lang in LANGUAGES_WITHOUT_SPACES:
-                word_idx += 1
-            elif cdx == len(text) - 1 or text[cdx+1] == " ":
-                word_idx += 1
-            
-        char_segments_arr = pd.DataFrame(char_segments_arr)
-
-        aligned_subsegments = []
-        # assign sentence_idx to each character index
-        char_segments_arr["sentence-idx"] = None
-        for sdx, (sstart, send) in enumerate(segment["sentence_spans"]):
-            curr_chars = char_segments_arr.loc[(char_segments_arr.index >= sstart) & (char_segments_arr.index <= send)]
-            char_segments_arr.loc[(char_segments_arr.index >= sstart) & (char_segments_arr.index <= send), "sentence-idx"] = sdx
-        
-            sentence_text = text[sstart:send]
-            sentence_start = curr_chars["start"].min()
-            end_chars = curr_chars[curr_chars["char"] != ' ']
-            sentence_end = end_chars["end"].max()
-            sentence_words = []
-
-            for word_idx in curr_chars["word-idx"].unique():
-                word_chars = curr_chars.loc[curr_chars["word-idx"] == word_idx]
-                word_text = "".join(word_chars["char"].tolist()).strip()
-                if len(word_text) == 0:
-                    continue
-
-                # dont use space character for alignment
-                word_chars = word_chars[word_chars["char"] != " "]
-
-                word_start = word_chars["start"].min()
-                word_end = word_chars["end"].max()
-                word_score = round(word_chars["score"].mean(), 3)
-
-                # -1 indicates unalignable 
-                word_segment = {"word": word_text}
-
-                if not np.isnan(word_start):
-                    word_segment["start"] = word_start
-                if not np.isnan(word_end):
-                    word_segment["end"] = word_end
-                if not np.isnan(word_score):
-                    word_segment["score"] = word_score
-
-                sentence_words.append(word_segment)
-            
-            aligned_subsegments.append({
-                "text": sentence_text,
-                "start": sentence_start,
-                "end": sentence_end,
-                "words": sentence_words,
-            })
+            subsegment["text"].append(text[sstart:send])
+            subsegment["words"] += sentence_words[sentence_id]
 
             if return_char_alignments:
-                curr_chars = curr_chars[["char", "start", "end", "score"]]
-                curr_chars.fillna(-1, inplace=True)
-                curr_chars = curr_chars.to_dict("records")
-                curr_chars = [{key: val for key, val in char.items() if val != -1} for char in curr_chars]
-                aligned_subsegments[-1]["chars"] = curr_chars
-
-        aligned_subsegments = pd.DataFrame(aligned_subsegments)
-        aligned_subsegments["start"] = interpolate_nans(aligned_subsegments["start"], method=interpolate_method)
-        aligned_subsegments["end"] = interpolate_nans(aligned_subsegments["end"], method=interpolate_method)
-        # concatenate sentences with same timestamps
-        agg_dict = {"text": " ".join, "words": "sum"}
-        if model_lang in LANGUAGES_WITHOUT_SPACES:
-            agg_dict["text"] = "".join
-        if return_char_alignments:
-            agg_dict["chars"] = "sum"
-        aligned_subsegments= aligned_subsegments.groupby(["start", "end"], as_index=False).agg(agg_dict)
-        aligned_subsegments = aligned_subsegments.to_dict('records')
-        aligned_segments += aligned_subsegments
+                sentence_chars = [
+                    {
+                        key: float(val) if key != "char" else val
+                        for key, val in zip(("char", "start", "end", "score"), (text[cdx], *values))
+                        if key == "char" or not np.isnan(val)
+                    }
+                    for cdx, *values in zip(
+                        range(*sentence_ranges[sentence_id]),
+                        char_starts[slice(*sentence_ranges[sentence_id])],
+                        char_ends[slice(*sentence_ranges[sentence_id])],
+                        char_scores[slice(*sentence_ranges[sentence_id])],
+                    )
+                ]
+                subsegment["chars"] = subsegment.get("chars", []) + sentence_chars
+
+        join = "".join if model_lang in LANGUAGES_WITHOUT_SPACES else " ".join
+        for subsegment in aligned_subsegments.values():
+            subsegment["text"] = join(subsegment["text"])
+            aligned_segments.append(subsegment)
 
     # create word_segments list
     word_segments: List[SingleWordSegment] = []
@@ -458,69 +531,147 @@ def align(
 source: https://pytorch.org/tutorials/intermediate/forced_alignment_with_torchaudio_tutorial.html
 """
 
-def get_trellis(emission, tokens, blank_id=0):
-    num_frame = emission.shape[0]
-    num_tokens = len(tokens)
-
-    # Trellis has extra diemsions for both time axis and tokens.
-    # The extra dim for tokens represents <SoS> (start-of-sentence)
-    # The extra dim for time axis is for simplification of the code.
-    trellis = np.empty((num_frame + 1, num_tokens + 1))
-    trellis[0, 0] = 0
-    trellis[1:, 0] = np.cumsum(emission[:, 0], 0)
-    trellis[0, -num_tokens:] = -float("inf")
-    trellis[-num_tokens:, 0] = float("inf")
-
-    for t in range(num_frame):
-        trellis[t + 1, 1:] = np.maximum(
-            # Score for staying at the same token
-            trellis[t, 1:] + emission[t, blank_id],
-            # Score for changing to the next token
-            trellis[t, :-1] + emission[t, tokens],
-        )
-    return trellis
-
-@dataclass
-class Point:
-    token_index: int
-    time_index: int
-    score: float
+@jax.jit
+def ctc_align(emissions, tokens, num_frames, num_tokens, blank_id=0):
+    """
+    Batched CTC forced alignment, as in the torchaudio tutorial linked above, for a padded batch of segments: the
+    Viterbi trellis and its backtrack are each computed by a single `lax.scan` on device.
+
+    Args:
+        emissions (`jnp.ndarray` of shape `(batch_size, max_frames, vocab_size)`):
+            The log-probabilities of the alignment model, padded past `num_frames`.
+        tokens (`jnp.ndarray` of shape `(batch_size, max_tokens)`):
+            The token ids of the transcripts, padded past `num_tokens`.
+        num_frames (`jnp.ndarray` of shape `(batch_size,)`):
+            The number of frames of each segment.
+        num_tokens (`jnp.ndarray` of shape `(batch_size,)`):
+            The number of tokens of each segment.
+        blank_id (`int`, *optional*, defaults to 0):
+            The id of the CTC blank token.
+
+    Returns:
+        `tuple` of `token_starts`, `token_ends` (`jnp.ndarray` of shape `(batch_size, max_tokens)`, the frame span
+        `[start, end)` of each token, i.e. the frames of the repeated token and the blanks after it), `token_scores`
+        (the mean frame-wise probability of each token) and `success` (`jnp.ndarray` of shape `(batch_size,)`, `False`
+        where the backtrack failed).
+    """
+    batch_size, max_frames, _ = emissions.shape
+    max_tokens = tokens.shape[1]
+    emissions = emissions.astype(jnp.float32)
+    token_emissions = jnp.take_along_axis(emissions, tokens[:, None, :], axis=2)
+    blank_emissions = jnp.take(emissions, blank_id, axis=2)
+
+    # the trellis has an extra row for the time before the first frame and an extra column for <SoS>
+    rows = jnp.arange(max_frames + 1)
+    first_column = jnp.concatenate([jnp.zeros((batch_size, 1)), jnp.cumsum(blank_emissions, axis=1)], axis=1)
+    first_column = jnp.where(rows >= (num_frames + 1 - num_tokens)[:, None], jnp.inf, first_column)
+    first_row = jnp.concatenate([first_column[:, :1], jnp.full((batch_size, max_tokens), -jnp.inf)], axis=1)
+
+    def trellis_step(trellis_row, inputs):
+        blank_emission, token_emission, first_column_value = inputs
+        stayed = trellis_row[:, 1:] + blank_emission[:, None]
+        changed = trellis_row[:, :-1] + token_emission
+        next_row = jnp.concatenate([first_column_value[:, None], jnp.maximum(stayed, changed)], axis=1)
+        last_token_score = jnp.take_along_axis(next_row, num_tokens[:, None], axis=1)[:, 0]
+        # only the decisions are kept for the backtrack, not the whole trellis
+        return next_row, (changed > stayed, last_token_score)
+
+    _, (changed, last_token_scores) = jax.lax.scan(
+        trellis_step,
+        first_row,
+        (blank_emissions.T, jnp.swapaxes(token_emissions, 0, 1), first_column[:, 1:].T),
+    )
+    last_token_scores = jnp.concatenate([first_row[None, jnp.arange(batch_size), num_tokens], last_token_scores])
+    last_token_scores = jnp.where(rows[:, None] <= num_frames, last_token_scores, -jnp.inf)
+    t_start = jnp.argmax(last_token_scores, axis=0)
+
+    token_range = jnp.arange(max_tokens)
+
+    def backtrack_step(carry, inputs):
+        j, token_starts, score_sums, frame_counts = carry
+        t, frame_changed, blank_emission, token_emission = inputs
+        active = (t <= t_start) & (j > 0)
+        token_index = jnp.maximum(j - 1, 0)
+        token_changed = jnp.take_along_axis(frame_changed, token_index[:, None], axis=1)[:, 0]
+        token_emission = jnp.take_along_axis(token_emission, token_index[:, None], axis=1)[:, 0]
+        prob = jnp.exp(jnp.where(token_changed, token_emission, blank_emission))
+
+        update = active[:, None] & (token_range == token_index[:, None])
+        score_sums = score_sums + jnp.where(update, prob[:, None], 0.0)
+        frame_counts = frame_counts + update
+        token_starts = jnp.where(update & token_changed[:, None], t - 1, token_starts)
+        j = jnp.where(active & token_changed, j - 1, j)
+        return (j, token_starts, score_sums, frame_counts), None
+
+    carry = (
+        num_tokens,
+        jnp.zeros((batch_size, max_tokens), dtype=jnp.int32),
+        jnp.zeros((batch_size, max_tokens)),
+        jnp.zeros((batch_size, max_tokens), dtype=jnp.int32),
+    )
+    (j, token_starts, score_sums, frame_counts), _ = jax.lax.scan(
+        backtrack_step,
+        carry,
+        (rows[1:], changed, blank_emissions.T, jnp.swapaxes(token_emissions, 0, 1)),
+        reverse=True,
+    )
+
+    # a token ends where the next one starts, and the last one at the start of the backtrack
+    token_ends = jnp.concatenate([token_starts[:, 1:], jnp.zeros((batch_size, 1), dtype=jnp.int32)], axis=1)
+    token_ends = jnp.where(token_range == (num_tokens - 1)[:, None], t_start[:, None], token_ends)
+    token_scores = score_sums / jnp.maximum(frame_counts, 1)
+    return token_starts, token_ends, token_scores, j == 0
+
+
+def next_power_of_two(x, minimum=16):
+    return max(minimum, 1 << (int(x) - 1).bit_length())
+
+
+def align_emissions_batch(emissions, tokens, num_frames, blank_id=0):
+    """
+    Aligns a padded batch of emissions with [`ctc_align`]. The emissions can stay on device: [`ctc_align`] only reads
+    their blank and transcript columns there, and only the frame spans and scores of the tokens are transferred.
+
+    Args:
+        emissions (`jnp.ndarray` of shape `(batch_size, max_frames, vocab_size)`): the padded log-probabilities.
+        tokens (`List[List[int]]`): the token ids of the transcript of the first rows, an empty list for the rows not
+            to align.
+        num_frames (`List[int]`): the number of frames of these rows.
+
+    Returns:
+        `List[Optional[List[Segment]]]`: for each row of `tokens`, the frame span and score of each token, with the
+        token index as label, or `None` if it was not aligned or the backtrack failed.
+    """
+    batch_size = emissions.shape[0]
+    # the tokens are padded to a power of two, such that few shapes get compiled
+    padded_tokens = np.zeros((batch_size, next_power_of_two(max(len(t) for t in tokens))), dtype=np.int32)
+    # the rows not to align have no frame and a single token, so their backtrack fails straight away
+    padded_num_frames = np.zeros(batch_size, dtype=np.int32)
+    padded_num_tokens = np.ones(batch_size, dtype=np.int32)
+    for row, (segment_tokens, n) in enumerate(zip(tokens, num_frames)):
+        if segment_tokens:
+            padded_tokens[row, :len(segment_tokens)] = segment_tokens
+            padded_num_frames[row] = n
+            padded_num_tokens[row] = len(segment_tokens)
+
+    token_starts, token_ends, token_scores, success = jax.device_get(
+        ctc_align(emissions, padded_tokens, padded_num_frames, padded_num_tokens, blank_id)
+    )
+
+    char_segments = []
+    for row, segment_tokens in enumerate(tokens):
+        n = len(segment_tokens)
+        if not segment_tokens or not success[row]:
+            char_segments.append(None)
+            continue
+        char_segments.append([
+            Segment(k, start, end, score)
+            for k, start, end, score in zip(
+                range(n), token_starts[row, :n].tolist(), token_ends[row, :n].tolist(), token_scores[row, :n]
+            )
+        ])
+    return char_segments
 
-def backtrack(trellis, emission, tokens, blank_id=0):
-    # Note:
-    # j and t are indices for trellis, which has extra dimensions
-    # for time and tokens at the beginning.
-    # When referring to time frame index `T` in trellis,
-    # the corresponding index in emission is `T-1`.
-    # Similarly, when referring to token index `J` in trellis,
-    # the corresponding index in transcript is `J-1`.
-    j = trellis.shape[1] - 1
-    t_start = np.argmax(trellis[:, j])
-
-    path = []
-    for t in range(t_start, 0, -1):
-        # 1. Figure out if the current position was stay or change
-        # Note (again):
-        # `emission[J-1]` is the emission at time frame `J` of trellis dimension.
-        # Score for token staying the same from time frame J-1 to T.
-        stayed = trellis[t - 1, j] + emission[t - 1, blank_id]
-        # Score for token changing from C-1 at T-1 to J at T.
-        changed = trellis[t - 1, j - 1] + emission[t - 1, tokens[j - 1]]
-
-        # 2. Store the path with frame-wise probability.
-        prob = np.exp(emission[t - 1, tokens[j - 1] if changed > stayed else 0])
-        # Return token index and time index in non-trellis coordinate.
-        path.append(Point(j - 1, t - 1, prob))
-
-        # 3. Update the token
-        if changed > stayed:
-            j -= 1
-            if j == 0:
-                break
-    else:
-        # failed
-        return None
-    return path[::-1]
 
 # Merge the labels
 @dataclass
@@ -537,24 +688,6 @@ class Segment:
     def length(self):
         return self.end - self.start
 
-def merge_repeats(path, transcript):
-    i1, i2 = 0, 0
-    segments = []
-    while i1 < len(path):
-        while i2 < len(path) and path[i1].token_index == path[i2].token_index:
-            i2 += 1
-        score = sum(path[k].score for k in range(i1, i2)) / (i2 - i1)
-        segments.append(
-            Segment(
-                transcript[path[i1].token_index],
-                path[i1].time_index,
-                path[i2 - 1].time_index + 1,
-                score,
-            )
-        )
-        i1 = i2
-    return segments
-
 def merge_words(segments, separator="|"):
     words = []
     i1, i2 = 0, 0
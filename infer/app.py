@@ -3,12 +3,11 @@ import os
 import csv
 import jax
 import infererence
+# 转录引擎在启动时创建一次，所有请求复用同一份设备上的模型参数和编译结果
+engine = None
 def transcribe_audio(audio_file):
-    # 加载 Whisper 模型
-
-
     # 使用模型进行语音转文本
-    result,detected_language = infererence.process_audio(audio_file)
+    result,detected_language = engine.transcribe(audio_file)
 
     # 获取转录的文本分段
     segments = result#["segments"]
@@ -31,7 +30,8 @@ def transcribe_audio(audio_file):
             start_time = segment["start"] / 16000
             end_time = segment["end"] / 16000
             transcript = segment["text"]
-            writer.writerow([os.path.basename(audio_file), start_time, end_time, transcript, detected_language])
+            # 每个片段写入它自己检测出的语言
+            writer.writerow([os.path.basename(audio_file), start_time, end_time, transcript, segment.get("language", detected_language)])
     srt_file = "output.srt"
     with open(srt_file, mode="w", encoding="utf-8") as f:
         for i, segment in enumerate(result, start=1):
@@ -57,6 +57,9 @@ device = "tpu"
 if __name__ == "__main__":
     if device.lower() == "tpu":
         jax.distributed.initialize()
+    # 加载 Whisper 模型并预先编译
+    engine = infererence.TranscriptionEngine()
+    engine.warmup()
     # 创建 Gradio 界面
     with gr.Blocks() as demo:
         gr.Markdown("## 语音转文本工具")
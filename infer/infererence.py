@@ -1,5 +1,8 @@
 import argparse
+import threading
 import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 import jax
 import jax.numpy as jnp
 from flax.core.frozen_dict import freeze
@@ -8,7 +11,6 @@ from jax.sharding import PartitionSpec as P
 from transformers import WhisperConfig, WhisperProcessor
 import numpy as np
 from whisper_jax import FlaxWhisperForConditionalGeneration, InferenceState, PjitPartitioner
-import os
 import librosa
 #from silero_vad import load_silero_vad, read_audio, get_speech_timestamps
 from jax.experimental import mesh_utils
@@ -20,11 +22,12 @@ from vad import (
     SpeechTimestampsMap,
     VadOptions,
     collect_chunks,
-    get_speech_timestamps,
+    get_vad_pool,
     merge_segments,
+    pack_segments,
 )
 import re
-from align import load_align_model,align,SingleSegment
+from align import DEFAULT_ALIGN_MODELS_HF,load_align_model,align,SingleSegment
 def format_time(seconds):
     # 将秒转换为 SRT 格式的时间
     hours = int(seconds // 3600)
@@ -150,201 +153,321 @@ logical_axis_rules_dp = [
     ("num_mel", None),
     ("channels", None),
 ]
-global_align_model_cache = {}
-whisper_model_cahce = None
-whisper_model_params_cache = None
-whisper_model_processor_cache = None
-def get_align_model_with_cache(language_code):
-    """获取对齐模型，如果已经加载过则直接从缓存中返回"""
-    if language_code in global_align_model_cache:
-        print(f"Using cached align model for language: {language_code}")
-        return global_align_model_cache[language_code]
-    
-    print(f"Loading align model for language: {language_code}")
-    model_a, metadata = load_align_model(language_code=language_code)
-    global_align_model_cache[language_code] = (model_a, metadata)
-    return model_a, metadata
+class AlignModelManager:
+    """
+    Caches the wav2vec2 alignment models within a byte budget, evicting the least recently used ones past it. Models
+    are loaded in a background thread: `preload` is called as soon as language detection has picked the languages, so
+    that downloading and loading `FlaxWav2Vec2ForCTC` overlaps with Whisper decoding and `get` rarely has to wait.
+    """
+
+    def __init__(self, memory_budget_bytes=4 * 1024**3, num_devices=None):
+        self.memory_budget_bytes = memory_budget_bytes
+        # alignment replicates the params on every device of the mesh (see align.get_emission_function), so the
+        # replicas count towards the budget too
+        self.num_devices = jax.device_count() if num_devices is None else num_devices
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        self.lock = threading.Lock()
+        # language_code -> Future, in LRU order: the most recently used model comes last
+        self.models = OrderedDict()
+        self.model_bytes = {}
+
+    def preload(self, language_code):
+        """Starts loading the alignment model in the background, or only refreshes its LRU position if it is already
+        loaded or loading, and returns its future."""
+        with self.lock:
+            future = self.models.get(language_code)
+            if future is None:
+                print(f"Loading align model for language: {language_code}")
+                future = self.executor.submit(self._load, language_code)
+                self.models[language_code] = future
+            else:
+                self.models.move_to_end(language_code)
+            return future
+
+    def get(self, language_code):
+        """Returns `(model, metadata)`, waiting for the model to finish loading. A failed load is re-raised and not
+        cached, so the next call retries it."""
+        future = self.preload(language_code)
+        try:
+            return future.result()
+        except Exception:
+            with self.lock:
+                if self.models.get(language_code) is future:
+                    del self.models[language_code]
+            raise
+
+    def _load(self, language_code):
+        model_a, metadata = load_align_model(language_code=language_code)
+        param_bytes = sum(leaf.nbytes for leaf in jax.tree_util.tree_leaves(model_a.params))
+        with self.lock:
+            self.model_bytes[language_code] = param_bytes * (1 + self.num_devices)
+            self._evict(keep=language_code)
+        return model_a, metadata
+
+    def _evict(self, keep):
+        # evict loaded models from the least recently used one, never the one just loaded nor those still loading;
+        # dropping the model also frees its device params cached by align (a WeakKeyDictionary keyed on the model)
+        for language_code in list(self.models):
+            if sum(self.model_bytes.values()) <= self.memory_budget_bytes:
+                break
+            if language_code == keep or language_code not in self.model_bytes:
+                continue
+            print(f"Evicting align model for language: {language_code}")
+            del self.models[language_code]
+            del self.model_bytes[language_code]
+
+def split_by_timestamps(token_ids, timestamp_begin, eos_token_id, time_precision=0.02):
+    """把带时间戳的 token 序列按时间戳切成 (开始秒数, 结束秒数, 文本 token) 的片段, 没有结束时间戳的最后一段结束时间为 None"""
+    pieces = []
+    start_time = 0.0
+    text_tokens = []
+    for token in token_ids:
+        if token >= timestamp_begin:
+            time = (token - timestamp_begin) * time_precision
+            if text_tokens:
+                pieces.append((start_time, time, text_tokens))
+                text_tokens = []
+            start_time = time
+        elif token < eos_token_id:
+            # sot / 语言 / 任务 / eos 这些特殊 token 不属于文本
+            text_tokens.append(token)
+    if text_tokens:
+        pieces.append((start_time, None, text_tokens))
+    return pieces
 
 def remove_symbols(text):
     # 使用正则表达式匹配 <|符号|> 并提取中间的内容
     cleaned_text = re.sub(r"<\|([^|]+)\|>", r"\1", text)
     return cleaned_text
 
-def process_audio(file_path):
-    
-    BATCH_SIZE = 16
-    LANGUAGE_DETECT_BATCH_SIZE = 8
-    device_mesh = mesh_utils.create_device_mesh((jax.device_count(), 1))
-    mesh = Mesh(device_mesh, axis_names=("data", "model")) 
-    # processors/tokenizers are the same for all models, so just load from tiny and preprocess once
-    global whisper_model_processor_cache
-    global whisper_model_cahce
-    global whisper_model_params_cache
-    if whisper_model_processor_cache is None:
-        processor = WhisperProcessor.from_pretrained("openai/whisper-large-v3")
-        whisper_model_processor_cache = processor
-    else:
-        processor = whisper_model_processor_cache
-    if whisper_model_cahce is None or whisper_model_params_cache is None:
-        model, params = FlaxWhisperForConditionalGeneration.from_pretrained(
-            "openai/whisper-large-v3",
+def align_language_groups(language_groups, align_models, audio_data, mesh):
+    """按语言逐组对齐, 返回按开始时间排好序的片段, 每个片段带上它的语言"""
+    segments = []
+    for language, segs in language_groups.items():
+        language_code = remove_symbols(language)
+        try:
+            if language_code not in DEFAULT_ALIGN_MODELS_HF:
+                raise ValueError(f"No default align-model for language: {language_code}")
+            model_a, metadata = align_models.get(language_code)
+        except (ValueError, OSError) as e:
+            # 短的或者有噪声的片段可能被误判成没有对齐模型的语言, 此时转录已经成功了,
+            # 这一组不对齐, 只返回开始/结束时间和文本, 不让整个文件失败
+            print(f"Skipping alignment of {len(segs)} segments in {language}: {e}")
+            aligned_segments = [{"start": seg["start"], "end": seg["end"], "text": seg["text"]} for seg in segs]
+        else:
+            aligned_segments = align(segs, model_a, metadata, audio_data, mesh, return_char_alignments=False)["segments"]
+        for segment in aligned_segments:
+            segment["language"] = language
+        segments.extend(aligned_segments)
+    segments.sort(key=lambda segment: segment["start"])
+    return segments
+
+class TranscriptionEngine:
+    """
+    Long-lived transcription engine. It builds the device mesh, loads Whisper, casts its params to bf16 and uploads
+    them to the devices once, and jits the language detection and generation functions once, so that each request
+    only pays for its own audio. Create a single engine per process and reuse it for every request.
+    """
+
+    def __init__(
+        self,
+        model_name="openai/whisper-large-v3",
+        batch_size=16,
+        dense_packing=False,
+        align_memory_budget_bytes=4 * 1024**3,
+        vad_num_workers=4,
+    ):
+        self.batch_size = batch_size
+        # dense_packing: 把不相邻的 VAD 片段拼接成满 30s 的窗口 (去掉中间的静音), 稀疏的音频少跑很多次 encoder 和 decoder,
+        # 解码时输出时间戳, 按时间戳把文本切回原始时间轴
+        self.dense_packing = dense_packing
+        # 每个并发请求从池里拿一个独立的 VAD session, 不再排队等同一个 session; 每个 session 分到 cpu 核数 / vad_num_workers 个线程
+        self.vad_pool = get_vad_pool(vad_num_workers)
+
+        device_mesh = mesh_utils.create_device_mesh((jax.device_count(), 1))
+        self.mesh = Mesh(device_mesh, axis_names=("data", "model"))
+        self.align_models = AlignModelManager(align_memory_budget_bytes, num_devices=self.mesh.devices.size)
+        self.replicate_sharding = NamedSharding(self.mesh, PartitionSpec(None))
+        self.x_sharding = NamedSharding(self.mesh, PartitionSpec("data"))
+
+        self.processor = WhisperProcessor.from_pretrained(model_name)
+        self.model, params = FlaxWhisperForConditionalGeneration.from_pretrained(
+            model_name,
             _do_init=False,
             dtype=jnp.bfloat16,
         )
-        whisper_model_cahce = model
-        whisper_model_params_cache = params
-    else:
-        model = whisper_model_cahce
-        params = whisper_model_params_cache
+        # the bf16 params stay resident on device for the lifetime of the engine
+        self.params = jax.device_put(self.model.to_bf16(params), self.replicate_sharding)
+        self.language_token_ids = jnp.array(self.all_language_tokens())
 
-    def all_language_tokens():
+        self.jitted_encode = jax.jit(
+            self._encode,
+            in_shardings=(self.replicate_sharding, self.x_sharding),
+            out_shardings=self.x_sharding,
+        )
+        self.jitted_generate = jax.jit(
+            self._generate,
+            in_shardings=(self.replicate_sharding, self.x_sharding, self.x_sharding),
+            out_shardings=self.x_sharding,
+        )
+        self.jitted_language_detect = jax.jit(
+            self._language_detect,
+            in_shardings=(self.replicate_sharding, self.x_sharding),
+            out_shardings=self.x_sharding,
+        )
+
+    def all_language_tokens(self):
         result = []
-        for token, token_id in zip(processor.tokenizer.all_special_tokens,processor.tokenizer.all_special_ids):
+        for token, token_id in zip(self.processor.tokenizer.all_special_tokens,self.processor.tokenizer.all_special_ids):
             if token.strip("<|>") in LANGUAGES:
                 result.append(token_id)
         return tuple(result)
-    # def init_fn():
-    #     input_shape = (1, 128, 3000)
-
-    #     input_features = jnp.zeros(input_shape, dtype="f4")
-    #     input_features = input_features.at[(..., -1)].set(model.config.eos_token_id)
-
-    #     decoder_input_ids = jnp.zeros((input_shape[0], 1), dtype="i4")
-    #     decoder_attention_mask = jnp.ones_like(decoder_input_ids)
-
-    #     batch_size, sequence_length = decoder_input_ids.shape
-    #     decoder_position_ids = jnp.broadcast_to(jnp.arange(sequence_length)[None, :], (batch_size, sequence_length))
-
-    #     rng = jax.random.PRNGKey(0)
-    #     init_params = model.module.init(
-    #         rng,
-    #         input_features=input_features,
-    #         decoder_input_ids=decoder_input_ids,
-    #         decoder_attention_mask=decoder_attention_mask,
-    #         decoder_position_ids=decoder_position_ids,
-    #         return_dict=False,
-    #     )
-    #     return init_params
-
-    # Axis names metadata
-    #param_axes = jax.eval_shape(init_fn)["params_axes"]
-
-    # Create InferenceState, since the partitioner expects it
-    # state = InferenceState(
-    #     step=jnp.array(0),
-    #     params=freeze(model.params_shape_tree),
-    #     params_axes=freeze(param_axes),
-    #     flax_mutables=None,
-    #     flax_mutables_axes=param_axes,
-    # )
-
-    # partitioner = PjitPartitioner(
-    #     num_partitions=1,
-    #     #model_parallel_submesh=(2,2,1,1),
-    #     logical_axis_rules=logical_axis_rules_dp,
-    # )
-
-    #mesh_axes = partitioner.get_mesh_axes(state)
-    #params_spec = mesh_axes.params
-
-    #p_shard_params = partitioner.partition(model.to_bf16, (params_spec,), params_spec)
-    replicate_sharding = NamedSharding(mesh,PartitionSpec(None))
-    x_sharding = NamedSharding(mesh,PartitionSpec("data"))
-
-    def generate(params, input_features,language):
-        output_ids = model.generate(input_features, params=params,language=language).sequences
+
+    def _encode(self, params, input_features):
+        return self.model.encode(input_features=input_features, params=params).last_hidden_state
+
+    def _generate(self, params, encoder_hidden_states, language_tokens):
+        # one language token id per row (a traced array), so one executable serves every mix of detected languages
+        output_ids = self.model.generate(
+            encoder_outputs=encoder_hidden_states,
+            params=params,
+            language=language_tokens,
+            return_timestamps=self.dense_packing,
+        ).sequences
         return output_ids
-    jitted_generate = jax.jit(generate,in_shardings=(replicate_sharding,x_sharding),out_shardings=x_sharding,static_argnums=(2,))
-    # p_generate = partitioner.partition(
-    #     generate,
-    #     in_axis_resources=(P(None), P("data")),
-    #     out_axis_resources=P("data"),
-    #     static_argnums=(2,)
-    # )
-    params = model.to_bf16(params)
-    #params = jax.device_put(params,jax.devices()[0])
-    # This will auto-magically run in mesh context
-    #params = p_shard_params(freeze(params))
-
-    #supported_formats = ('.wav', '.mp3', '.flac', '.ogg', '.m4a')
-    #output_csv = "transcriptions.csv"
-
-
-    # 使用 librosa 加载音频文件
-    audio_data, sample_rate = librosa.load(file_path, sr=16000)  # sr=None 保持原始采样率
-    print(f"Successfully loaded {file_path}")
-    #print(f"Sample Rate: {sample_rate}, Audio Data Length: {len(audio_data)}")
-    vad_parameters = VadOptions(
-        max_speech_duration_s=30,
-        min_silence_duration_ms=160,
-    )
-    active_segments = get_speech_timestamps(audio_data, vad_parameters)
-    clip_timestamps = merge_segments(active_segments, vad_parameters)
-    
-    audio_segments = []
-    segments_info = []
-    logits = None
-    i = 0
-    
-    for timestamp in clip_timestamps:
-        #start, end = int(timestamp["start"] * sample_rate), int(timestamp["end"] * sample_rate)
-        segment = audio_data[timestamp["start"]:timestamp["end"]]
-        
-        # 对片段进行预处理
-        processed_segment = processor(segment, sampling_rate=16000, return_tensors="np")
-        audio_segments.append(processed_segment.input_features[0])
-        segments_info.append((os.path.basename(file_path), timestamp["start"], timestamp["end"]))
-
-    def language_detect_wrap(params,input_features):
-        encoder_outputs = model.encode(input_features=input_features,params=params)
-        decoder_start_token_id = model.config.decoder_start_token_id
-        decoder_input_ids = jnp.ones((input_features.shape[0], 1), dtype="i4") * decoder_start_token_id
-        outputs = model.decode(decoder_input_ids, encoder_outputs,params=params)
-        return outputs.logits
-    
-    
-    params = jax.device_put(params,replicate_sharding)
-    jitted_language_detect_func = jax.jit(language_detect_wrap,in_shardings=(replicate_sharding,x_sharding),out_shardings=x_sharding)
-    language_detect_segments = jnp.stack(audio_segments[:LANGUAGE_DETECT_BATCH_SIZE],axis=0)
-    LD_B_padding = LANGUAGE_DETECT_BATCH_SIZE - language_detect_segments.shape[0]
-    padded_language_detect_segments = jnp.pad(language_detect_segments,((0,LD_B_padding),(0,0),(0,0)))
-    if logits is None:
-        logits = jitted_language_detect_func(params,padded_language_detect_segments)
-    else:
-        logits += jitted_language_detect_func(params,padded_language_detect_segments)
-    def language_mask_wrap(logits):
-        logits = jnp.sum(logits,axis=0,keepdims=True)
-        mask = jnp.ones(logits.shape[-1], dtype=jnp.bool)
-        mask = mask.at[jnp.array(all_language_tokens())].set(False)
-        logits = jnp.where(mask,-jnp.inf,logits)
-        language_tokens = jnp.argmax(logits,axis=-1)
-        return language_tokens
-    language_tokens = jax.jit(language_mask_wrap)(logits)
-    detected_language = processor.decode(language_tokens[0,0])
-
-    
-    rounds = (len(audio_segments)-1) // BATCH_SIZE + 1
-    pred_ids_result = None
-    for i in range(rounds):
-        stacked_audio = audio_segments[i*BATCH_SIZE:(i+1)*BATCH_SIZE]
-        stacked_audio = np.stack(stacked_audio)
-        padding_size = BATCH_SIZE - stacked_audio.shape[0]
-        padded_stacked_audio = np.pad(stacked_audio,((0,padding_size),(0,0),(0,0)))
-        padded_stacked_audio = jnp.asarray(padded_stacked_audio)
-        pred_ids = jitted_generate(params, padded_stacked_audio,detected_language)
-        pred_ids = pred_ids[:BATCH_SIZE - padding_size]
-        pred_ids = np.asarray(pred_ids)
-        if pred_ids_result is None:
-            pred_ids_result = pred_ids
+
+    def _language_detect(self, params, encoder_hidden_states):
+        # 只在语言 token 上做投影, 不再算整个词表的 logits; 每个片段单独判断语言
+        language_probs = self.model.detect_language(
+            encoder_outputs=encoder_hidden_states, language_token_ids=self.language_token_ids, params=params
+        )
+        return self.language_token_ids[jnp.argmax(language_probs, axis=-1)]
+
+    def warmup(self):
+        """Compiles the encoder, language detection and generation ahead of the first request."""
+        input_shape = (self.model.config.num_mel_bins, 2 * self.model.config.max_source_positions)
+        encoder_hidden_states = self.encode([np.zeros(input_shape, dtype=np.float32)])
+        language_tokens = self.detect_language(encoder_hidden_states)
+        jax.block_until_ready(self.generate(encoder_hidden_states, language_tokens, 1))
+
+    def encode(self, audio_segments):
+        # 一个 batch 只跑一次 encoder, 输出留在 device 上同时给语言检测和 generate 用
+        stacked_audio = np.stack(audio_segments)
+        padding_size = self.batch_size - stacked_audio.shape[0]
+        padded_stacked_audio = np.pad(stacked_audio, ((0, padding_size), (0, 0), (0, 0)))
+        return self.jitted_encode(self.params, padded_stacked_audio)
+
+    def detect_language(self, encoder_hidden_states):
+        # 返回 device 上每个片段的语言 token id, 直接喂给 generate
+        return self.jitted_language_detect(self.params, encoder_hidden_states)
+
+    def generate(self, encoder_hidden_states, language_tokens, num_segments):
+        # 只派发不等待, 返回 device 上的结果, 调用方在 generate 运行期间可以做别的事
+        pred_ids = self.jitted_generate(self.params, encoder_hidden_states, language_tokens)
+        return pred_ids[:num_segments]
+
+    def transcribe(self, file_path):
+        # 使用 librosa 加载音频文件
+        audio_data, sample_rate = librosa.load(file_path, sr=16000)  # sr=None 保持原始采样率
+        print(f"Successfully loaded {file_path}")
+        vad_parameters = VadOptions(
+            max_speech_duration_s=30,
+            min_silence_duration_ms=160,
+        )
+        active_segments = self.vad_pool.get_speech_timestamps(audio_data, vad_parameters)
+        if self.dense_packing:
+            clip_timestamps = pack_segments(active_segments, vad_parameters)
+        else:
+            clip_timestamps = merge_segments(active_segments, vad_parameters)
+
+        audio_segments = []
+        for timestamp in clip_timestamps:
+            if self.dense_packing:
+                # 只拼接语音部分, 中间的静音不送进模型
+                segment = np.concatenate(collect_chunks(audio_data, timestamp["segments"])[0])
+            else:
+                segment = audio_data[timestamp["start"]:timestamp["end"]]
+
+            # 对片段进行预处理
+            processed_segment = self.processor(segment, sampling_rate=16000, return_tensors="np")
+            audio_segments.append(processed_segment.input_features[0])
+
+        if not audio_segments:
+            return [], None
+
+        # 每个 batch 只编码一次: 同一份 encoder 输出既做逐片段的语言检测, 又直接用于 generate
+        # 语言按行强制, 所以不同语言的片段可以在同一个 batch 里解码 (适用于中英混说的会议录音)
+        BATCH_SIZE = self.batch_size
+        pred_ids_result = []
+        language_tokens_result = []
+        for i in range(0, len(audio_segments), BATCH_SIZE):
+            batch = audio_segments[i:i+BATCH_SIZE]
+            encoder_hidden_states = self.encode(batch)
+            language_tokens = self.detect_language(encoder_hidden_states)
+            pred_ids = self.generate(encoder_hidden_states, language_tokens, len(batch))
+            # generate 已经派发出去了, 语言 token 先拷回来, 在解码的同时后台加载这些语言的对齐模型
+            batch_language_tokens = np.asarray(language_tokens[:len(batch)])
+            for language_token in np.unique(batch_language_tokens):
+                language_code = remove_symbols(self.processor.decode(language_token))
+                # 没有对齐模型的语言 (多半是误判) 不预加载, 加载不可能成功
+                if language_code in DEFAULT_ALIGN_MODELS_HF:
+                    self.align_models.preload(language_code)
+            pred_ids_result.append(np.asarray(pred_ids))
+            language_tokens_result.append(batch_language_tokens)
+        pred_ids_result = np.concatenate(pred_ids_result, axis=0)
+        language_tokens_result = np.concatenate(language_tokens_result, axis=0)
+
+        if self.dense_packing:
+            transcript = self.split_packed_transcriptions(clip_timestamps, pred_ids_result, language_tokens_result)
         else:
-            pred_ids_result = np.concatenate([pred_ids_result,pred_ids],axis=0)
-    transcriptions = processor.batch_decode(pred_ids_result, skip_special_tokens=True)
+            transcriptions = self.processor.batch_decode(pred_ids_result, skip_special_tokens=True)
+            transcript = [
+                (timestamp["start"], timestamp["end"], transcription, language_token)
+                for timestamp, transcription, language_token in zip(clip_timestamps, transcriptions, language_tokens_result)
+            ]
+        if not transcript:
+            return [], None
 
+        # 按检测出的语言分组, 每组用对应语言的对齐模型
+        language_groups = {}
+        for start_time, end_time, transcription, language_token in transcript:
+            language = self.processor.decode(language_token)
+            seg = SingleSegment(start=start_time,end=end_time,text=transcription)
+            language_groups.setdefault(language, []).append(seg)
 
-    model_a, metadata = get_align_model_with_cache(language_code=remove_symbols(detected_language))
-    segs = []
-    for (_ ,start_time, end_time), transcription in zip(segments_info, transcriptions):
-        segs.append(SingleSegment(start=start_time,end=end_time,text=transcription))
-    result = align(segs, model_a, metadata, audio_data, mesh, return_char_alignments=False)
+        segments = align_language_groups(language_groups, self.align_models, audio_data, self.mesh)
 
-    return result["segments"],detected_language
\ No newline at end of file
+        # 整个文件的语言取片段数最多的那种
+        detected_language = max(language_groups, key=lambda language: len(language_groups[language]))
+        return segments,detected_language
+
+    def split_packed_transcriptions(self, clip_timestamps, pred_ids, language_tokens):
+        # 每个拼接窗口的文本按时间戳切开, 再把拼接后的时间映射回原始音频的时间 (单位: 采样点)
+        generation_config = self.model.generation_config
+        timestamp_begin = generation_config.no_timestamps_token_id + 1
+        transcript = []
+        for timestamp, token_ids, language_token in zip(clip_timestamps, pred_ids, language_tokens):
+            pieces = split_by_timestamps(token_ids.tolist(), timestamp_begin, generation_config.eos_token_id)
+            if not pieces:
+                continue
+            speech_duration = sum(chunk["end"] - chunk["start"] for chunk in timestamp["segments"]) / 16000
+            starts = np.array([start for start, _, _ in pieces])
+            ends = np.array([speech_duration if end is None else end for _, end, _ in pieces])
+            starts = np.minimum(starts, speech_duration)
+            ends = np.clip(ends, starts, speech_duration)
+
+            timestamps_map = SpeechTimestampsMap(timestamp["segments"], 16000)
+            starts = timestamps_map.get_original_time(starts)
+            ends = timestamps_map.get_original_time(ends, is_end=True)
+            texts = self.processor.batch_decode([tokens for _, _, tokens in pieces], skip_special_tokens=True)
+            for start, end, text in zip(starts.tolist(), ends.tolist(), texts):
+                transcript.append((int(round(start * 16000)), int(round(end * 16000)), text, language_token))
+        return transcript
+
+default_engine = None
+def process_audio(file_path):
+    # kept for scripts calling the module directly: the engine is created on first use and then reused
+    global default_engine
+    if default_engine is None:
+        default_engine = TranscriptionEngine()
+    return default_engine.transcribe(file_path)
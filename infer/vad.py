@@ -1,9 +1,11 @@
-import bisect
 import functools
 import os
+import queue
+
+from concurrent.futures import ThreadPoolExecutor
 
 from dataclasses import dataclass
-from typing import Dict, List, Optional, Tuple
+from typing import Dict, List, Optional, Tuple, Union
 
 import numpy as np
 
@@ -34,6 +36,18 @@ class VadOptions:
       min_silence_duration_ms: In the end of each speech chunk wait for min_silence_duration_ms
         before separating it
       speech_pad_ms: Final speech chunks are padded by speech_pad_ms each side
+      energy_gate: Skip silero VAD on long stretches whose energy stays close to the noise
+        floor, estimated as the 10th percentile of the window energies. These stretches
+        are treated as silence.
+      energy_gate_margin_db: Windows less than energy_gate_margin_db above the noise floor
+        can be gated.
+      energy_gate_max_floor_db: Upper bound of the noise floor, in dBFS. In a recording
+        with little silence the 10th percentile falls on quiet speech, which must not
+        be gated.
+      energy_gate_min_silence_ms: Only stretches of quiet windows longer than
+        energy_gate_min_silence_ms are gated.
+      energy_gate_edge_ms: Silero still runs on the first and last energy_gate_edge_ms
+        of a gated stretch, so the chunk boundaries around it are the ones of silero.
     """
 
     threshold: float = 0.5
@@ -42,12 +56,18 @@ class VadOptions:
     max_speech_duration_s: float = float("inf")
     min_silence_duration_ms: int = 2000
     speech_pad_ms: int = 400
+    energy_gate: bool = False
+    energy_gate_margin_db: float = 6.0
+    energy_gate_max_floor_db: float = -50.0
+    energy_gate_min_silence_ms: int = 3000
+    energy_gate_edge_ms: int = 1000
 
 
 def get_speech_timestamps(
     audio: np.ndarray,
     vad_options: Optional[VadOptions] = None,
     sampling_rate: int = 16000,
+    model: Optional["SileroVADModel"] = None,
     **kwargs,
 ) -> List[dict]:
     """This method is used for splitting long audios into speech chunks using silero VAD.
@@ -56,6 +76,7 @@ def get_speech_timestamps(
       audio: One dimensional float array.
       vad_options: Options for VAD processing.
       sampling rate: Sampling rate of the audio.
+      model: The VAD model to run, `get_vad_model()` by default.
       kwargs: VAD options passed as keyword arguments for backward compatibility.
 
     Returns:
@@ -64,123 +85,284 @@ def get_speech_timestamps(
     if vad_options is None:
         vad_options = VadOptions(**kwargs)
 
-    threshold = vad_options.threshold
-    min_speech_duration_ms = vad_options.min_speech_duration_ms
-    max_speech_duration_s = vad_options.max_speech_duration_s
-    min_silence_duration_ms = vad_options.min_silence_duration_ms
-    window_size_samples = 512
-    speech_pad_ms = vad_options.speech_pad_ms
-    min_speech_samples = sampling_rate * min_speech_duration_ms / 1000
-    speech_pad_samples = sampling_rate * speech_pad_ms / 1000
-    max_speech_samples = (
-        sampling_rate * max_speech_duration_s
-        - window_size_samples
-        - 2 * speech_pad_samples
+    if vad_options.energy_gate:
+        speech_probs = get_gated_speech_probs(
+            audio, vad_options, sampling_rate, model=model
+        )
+    else:
+        speech_probs = get_speech_probs([audio], model=model)[0]
+    return get_speech_timestamps_from_probs(
+        speech_probs, len(audio), vad_options, sampling_rate
     )
-    min_silence_samples = sampling_rate * min_silence_duration_ms / 1000
-    min_silence_samples_at_max_speech = sampling_rate * 98 / 1000
 
-    audio_length_samples = len(audio)
 
-    model = get_vad_model()
+def _next_true_index(mask: np.ndarray) -> np.ndarray:
+    """For each index, the index of the next True value of the mask at or after it.
+
+    The returned array has one extra entry, and the index is len(mask) if there is none.
+    """
+    indices = np.where(mask, np.arange(len(mask)), len(mask))
+    indices = np.minimum.accumulate(indices[::-1])[::-1]
+    return np.append(indices, len(mask))
+
+
+def get_speech_timestamps_from_probs(
+    speech_probs: np.ndarray,
+    audio_length_samples: int,
+    vad_options: VadOptions,
+    sampling_rate: int = 16000,
+    window_size_samples: int = 512,
+) -> List[dict]:
+    """Turns the speech probabilities of silero VAD into speech chunks.
+
+    Args:
+      speech_probs: Speech probability of each window, of shape (num_windows,) or
+        (num_windows, 1).
+      audio_length_samples: Number of samples of the audio.
+      vad_options: Options for VAD processing.
+      sampling rate: Sampling rate of the audio.
+      window_size_samples: Number of samples in each VAD window.
 
-    padded_audio = np.pad(
-        audio, (0, window_size_samples - audio.shape[0] % window_size_samples)
+    Returns:
+      List of dicts containing begin and end samples of each speech chunk.
+    """
+    segmenter = SpeechSegmenter(vad_options, sampling_rate, window_size_samples)
+    segmenter.push(speech_probs)
+    segmenter.finish(audio_length_samples)
+    return pad_speeches(
+        segmenter.speeches, audio_length_samples, segmenter.speech_pad_samples
     )
-    speech_probs = model(padded_audio.reshape(1, -1)).squeeze(0)
 
-    triggered = False
-    speeches = []
-    current_speech = {}
-    neg_threshold = vad_options.neg_threshold
 
-    # to save potential segment end (and tolerate some silence)
-    temp_end = 0
-    # to save potential segment limits in case of maximum segment size reached
-    prev_end = next_start = 0
+class SpeechSegmenter:
+    """The speech state machine of silero VAD, fed with window probabilities.
 
-    for i, speech_prob in enumerate(speech_probs):
-        if (speech_prob >= threshold) and temp_end:
-            temp_end = 0
-            if next_start < prev_end:
-                next_start = window_size_samples * i
+    The state machine (hysteresis between `threshold` and `neg_threshold`,
+    `min_silence_duration_ms` and the splitting at `max_speech_duration_s`) is the one
+    of silero VAD, but instead of stepping through every window it jumps from one window
+    that can change its state to the next. These windows are found with NumPy from the
+    threshold crossings: while not in speech, the next window above `threshold`; while in
+    speech, the next window below `neg_threshold` (only past the silence durations that
+    matter once a potential end was recorded), the next window above `threshold` once a
+    potential end was recorded, and the window exceeding the maximum duration. All other
+    windows leave the state untouched, so the chunks are exactly the ones of the
+    window-by-window loop, in a number of Python steps proportional to the number of
+    crossings rather than to the length of the audio.
 
-        if (speech_prob >= threshold) and not triggered:
-            triggered = True
-            current_speech["start"] = window_size_samples * i
-            continue
+    The probabilities can be pushed in several calls, the state being carried over. The
+    finalized (unpadded) chunks are appended to `speeches`.
+    """
 
-        if (
-            triggered
-            and (window_size_samples * i) - current_speech["start"] > max_speech_samples
-        ):
-            if prev_end:
-                current_speech["end"] = prev_end
-                speeches.append(current_speech)
-                current_speech = {}
-                # previously reached silence (< neg_thres) and is still not speech (< thres)
-                if next_start < prev_end:
-                    triggered = False
-                else:
-                    current_speech["start"] = next_start
-                prev_end = next_start = temp_end = 0
-            else:
-                current_speech["end"] = window_size_samples * i
-                speeches.append(current_speech)
-                current_speech = {}
-                prev_end = next_start = temp_end = 0
-                triggered = False
-                continue
+    def __init__(
+        self,
+        vad_options: VadOptions,
+        sampling_rate: int = 16000,
+        window_size_samples: int = 512,
+    ):
+        self.threshold = vad_options.threshold
+        self.neg_threshold = vad_options.neg_threshold
+        self.window_size_samples = window_size_samples
+        self.min_speech_samples = (
+            sampling_rate * vad_options.min_speech_duration_ms / 1000
+        )
+        self.speech_pad_samples = sampling_rate * vad_options.speech_pad_ms / 1000
+        self.max_speech_samples = (
+            sampling_rate * vad_options.max_speech_duration_s
+            - window_size_samples
+            - 2 * self.speech_pad_samples
+        )
+        self.min_silence_samples = (
+            sampling_rate * vad_options.min_silence_duration_ms / 1000
+        )
+        self.min_silence_samples_at_max_speech = sampling_rate * 98 / 1000
 
-        if (speech_prob < neg_threshold) and triggered:
-            if not temp_end:
-                temp_end = window_size_samples * i
-            # condition to avoid cutting in very short silence
-            if (window_size_samples * i) - temp_end > min_silence_samples_at_max_speech:
-                prev_end = temp_end
-            if (window_size_samples * i) - temp_end < min_silence_samples:
-                continue
+        self.num_windows = 0
+        self.speeches = []
+        self.triggered = False
+        self.current_speech = {}
+        # to save potential segment end (and tolerate some silence)
+        self.temp_end = 0
+        # to save potential segment limits in case of maximum segment size reached
+        self.prev_end = self.next_start = 0
+
+    def _first_window_past(self, offset, duration, strict=True):
+        # smallest window i with `window_size_samples * i - offset` > (or >=) duration
+        if duration == float("inf"):
+            return self.num_windows
+
+        def past(i):
+            elapsed = self.window_size_samples * i - offset
+            return elapsed > duration if strict else elapsed >= duration
+
+        i = max(int((offset + duration) // self.window_size_samples), 0)
+        while i > 0 and past(i - 1):
+            i -= 1
+        while not past(i):
+            i += 1
+        return min(i, self.num_windows)
+
+    def push(self, speech_probs: np.ndarray):
+        """Runs the state machine over the speech probabilities of the next windows."""
+        speech_probs = np.asarray(speech_probs).reshape(-1)
+        offset = self.num_windows
+        self.num_windows += len(speech_probs)
+
+        is_speech = speech_probs >= self.threshold
+        is_silence = speech_probs < self.neg_threshold
+        # Python lists, as the state machine below reads them one element at a time
+        next_speech = (_next_true_index(is_speech) + offset).tolist()
+        next_silence = (_next_true_index(is_silence) + offset).tolist()
+        is_speech = is_speech.tolist()
+        is_silence = is_silence.tolist()
+
+        window_size_samples = self.window_size_samples
+        triggered = self.triggered
+        current_speech = self.current_speech
+        temp_end = self.temp_end
+        prev_end = self.prev_end
+        next_start = self.next_start
+
+        i = offset
+        while i < self.num_windows:
+            # jump to the next window that can change the state
+            if not triggered:
+                i = next_speech[i - offset]
             else:
-                current_speech["end"] = temp_end
-                if (
-                    current_speech["end"] - current_speech["start"]
-                ) > min_speech_samples:
-                    speeches.append(current_speech)
-                current_speech = {}
-                prev_end = next_start = temp_end = 0
-                triggered = False
+                candidates = [
+                    self._first_window_past(
+                        current_speech["start"], self.max_speech_samples
+                    ),
+                ]
+                if temp_end:
+                    candidates.append(next_speech[i - offset])
+                    if prev_end != temp_end:
+                        at_max_speech = self._first_window_past(
+                            temp_end, self.min_silence_samples_at_max_speech
+                        )
+                        candidates.append(next_silence[max(i, at_max_speech) - offset])
+                    end_of_speech = self._first_window_past(
+                        temp_end, self.min_silence_samples, strict=False
+                    )
+                    candidates.append(next_silence[max(i, end_of_speech) - offset])
+                else:
+                    candidates.append(next_silence[i - offset])
+                i = max(i, min(candidates))
+            if i >= self.num_windows:
+                break
+
+            # one step of the silero state machine
+            if is_speech[i - offset] and temp_end:
+                temp_end = 0
+                if next_start < prev_end:
+                    next_start = window_size_samples * i
+
+            if is_speech[i - offset] and not triggered:
+                triggered = True
+                current_speech["start"] = window_size_samples * i
+                i += 1
                 continue
 
-    if (
-        current_speech
-        and (audio_length_samples - current_speech["start"]) > min_speech_samples
-    ):
-        current_speech["end"] = audio_length_samples
-        speeches.append(current_speech)
-
-    for i, speech in enumerate(speeches):
-        if i == 0:
-            speech["start"] = int(max(0, speech["start"] - speech_pad_samples))
-        if i != len(speeches) - 1:
-            silence_duration = speeches[i + 1]["start"] - speech["end"]
-            if silence_duration < 2 * speech_pad_samples:
-                speech["end"] += int(silence_duration // 2)
-                speeches[i + 1]["start"] = int(
-                    max(0, speeches[i + 1]["start"] - silence_duration // 2)
-                )
-            else:
-                speech["end"] = int(
-                    min(audio_length_samples, speech["end"] + speech_pad_samples)
-                )
-                speeches[i + 1]["start"] = int(
-                    max(0, speeches[i + 1]["start"] - speech_pad_samples)
-                )
-        else:
-            speech["end"] = int(
-                min(audio_length_samples, speech["end"] + speech_pad_samples)
-            )
+            if (
+                triggered
+                and (window_size_samples * i) - current_speech["start"]
+                > self.max_speech_samples
+            ):
+                if prev_end:
+                    current_speech["end"] = prev_end
+                    self.speeches.append(current_speech)
+                    current_speech = {}
+                    # previously reached silence (< neg_thres) and is still not speech
+                    if next_start < prev_end:
+                        triggered = False
+                    else:
+                        current_speech["start"] = next_start
+                    prev_end = next_start = temp_end = 0
+                else:
+                    current_speech["end"] = window_size_samples * i
+                    self.speeches.append(current_speech)
+                    current_speech = {}
+                    prev_end = next_start = temp_end = 0
+                    triggered = False
+                    i += 1
+                    continue
+
+            if is_silence[i - offset] and triggered:
+                if not temp_end:
+                    temp_end = window_size_samples * i
+                # condition to avoid cutting in very short silence
+                silence_samples = (window_size_samples * i) - temp_end
+                if silence_samples > self.min_silence_samples_at_max_speech:
+                    prev_end = temp_end
+                if silence_samples >= self.min_silence_samples:
+                    current_speech["end"] = temp_end
+                    if (
+                        current_speech["end"] - current_speech["start"]
+                    ) > self.min_speech_samples:
+                        self.speeches.append(current_speech)
+                    current_speech = {}
+                    prev_end = next_start = temp_end = 0
+                    triggered = False
+
+            i += 1
+
+        self.triggered = triggered
+        self.current_speech = current_speech
+        self.temp_end = temp_end
+        self.prev_end = prev_end
+        self.next_start = next_start
+
+    def finish(self, audio_length_samples: int):
+        """Closes the chunk still open at the end of the audio."""
+        if (
+            self.current_speech
+            and (audio_length_samples - self.current_speech["start"])
+            > self.min_speech_samples
+        ):
+            self.current_speech["end"] = audio_length_samples
+            self.speeches.append(self.current_speech)
+        self.current_speech = {}
+        self.triggered = False
+
+
+def pad_speeches(
+    speeches: List[dict], audio_length_samples: int, speech_pad_samples: float
+) -> List[dict]:
+    """Pads each chunk by `speech_pad_samples`, or splits the silence in half between
+    two chunks closer than twice the padding."""
+    if not speeches:
+        return []
+
+    starts = np.array([speech["start"] for speech in speeches], dtype=np.float64)
+    ends = np.array([speech["end"] for speech in speeches], dtype=np.float64)
+    silence_durations = starts[1:] - ends[:-1]
+    short_silences = silence_durations < 2 * speech_pad_samples
+    half_silences = silence_durations // 2
+
+    padded_starts = np.empty_like(starts)
+    padded_ends = np.empty_like(ends)
+    padded_starts[0] = max(0, starts[0] - speech_pad_samples)
+    padded_starts[1:] = np.maximum(
+        0,
+        np.where(
+            short_silences,
+            starts[1:] - half_silences,
+            starts[1:] - speech_pad_samples,
+        ),
+    )
+    padded_ends[:-1] = np.where(
+        short_silences,
+        ends[:-1] + half_silences,
+        np.minimum(audio_length_samples, ends[:-1] + speech_pad_samples),
+    )
+    padded_ends[-1] = min(audio_length_samples, ends[-1] + speech_pad_samples)
 
-    return speeches
+    return [
+        {"start": start, "end": end}
+        for start, end in zip(
+            np.floor(padded_starts).astype(np.int64).tolist(),
+            np.floor(padded_ends).astype(np.int64).tolist(),
+        )
+    ]
 
 
 def collect_chunks(
@@ -207,53 +389,396 @@ def collect_chunks(
 
 
 class SpeechTimestampsMap:
-    """Helper class to restore original speech timestamps."""
+    """Helper class to restore original speech timestamps.
+
+    The times can be scalars or arrays, so all the timestamps of a transcription are
+    restored at once.
+    """
 
     def __init__(self, chunks: List[dict], sampling_rate: int, time_precision: int = 2):
         self.sampling_rate = sampling_rate
         self.time_precision = time_precision
-        self.chunk_end_sample = []
-        self.total_silence_before = []
-
-        previous_end = 0
-        silent_samples = 0
 
-        for chunk in chunks:
-            silent_samples += chunk["start"] - previous_end
-            previous_end = chunk["end"]
+        starts = np.array([chunk["start"] for chunk in chunks], dtype=np.int64)
+        ends = np.array([chunk["end"] for chunk in chunks], dtype=np.int64)
+        silent_samples = np.cumsum(starts - np.concatenate([[0], ends[:-1]]))
 
-            self.chunk_end_sample.append(chunk["end"] - silent_samples)
-            self.total_silence_before.append(silent_samples / sampling_rate)
+        self.chunk_end_sample = ends - silent_samples
+        self.total_silence_before = silent_samples / sampling_rate
 
     def get_original_time(
         self,
-        time: float,
-        chunk_index: Optional[int] = None,
-    ) -> float:
+        time: Union[float, np.ndarray],
+        chunk_index: Optional[Union[int, np.ndarray]] = None,
+        is_end: bool = False,
+    ) -> Union[float, np.ndarray]:
         if chunk_index is None:
-            chunk_index = self.get_chunk_index(time)
+            chunk_index = self.get_chunk_index(time, is_end)
 
         total_silence_before = self.total_silence_before[chunk_index]
-        return round(total_silence_before + time, self.time_precision)
+        original_time = np.round(total_silence_before + time, self.time_precision)
+        return original_time.tolist() if np.ndim(original_time) == 0 else original_time
 
-    def get_chunk_index(self, time: float) -> int:
-        sample = int(time * self.sampling_rate)
-        return min(
-            bisect.bisect(self.chunk_end_sample, sample),
+    def get_chunk_index(
+        self, time: Union[float, np.ndarray], is_end: bool = False
+    ) -> Union[int, np.ndarray]:
+        # an end time falling on the end of a chunk belongs to that chunk, not the next
+        sample = (np.asarray(time) * self.sampling_rate).astype(np.int64)
+        chunk_index = np.minimum(
+            np.searchsorted(
+                self.chunk_end_sample, sample, side="left" if is_end else "right"
+            ),
             len(self.chunk_end_sample) - 1,
         )
+        return chunk_index.tolist() if np.ndim(chunk_index) == 0 else chunk_index
 
 
 @functools.lru_cache
-def get_vad_model():
+def get_vad_model(decoder_backend: str = "onnx"):
     """Returns the VAD model instance."""
     encoder_path = os.path.join(get_assets_path(), "silero_encoder_v5.onnx")
     decoder_path = os.path.join(get_assets_path(), "silero_decoder_v5.onnx")
-    return SileroVADModel(encoder_path, decoder_path)
+    return SileroVADModel(encoder_path, decoder_path, decoder_backend=decoder_backend)
+
+
+class VadSessionPool:
+    """Runs silero VAD on several audios concurrently.
+
+    The pool holds `num_workers` VAD models, each with its own ONNX sessions limited to
+    `os.cpu_count() // num_workers` intra-op threads, and a thread per model.
+    onnxruntime and the jax decoder release the GIL, so the workers run in parallel
+    and the throughput scales with the number of cores, while a single session only
+    scales as far as the intra-op parallelism of one audio goes.
+
+    ```python
+    vad_pool = get_vad_pool()
+    speech_chunks = vad_pool.get_speech_timestamps_many(audios, vad_options)
+    ```
+    """
+
+    def __init__(
+        self,
+        num_workers: Optional[int] = None,
+        decoder_backend: str = "onnx",
+        batch_size: int = 8,
+    ):
+        """
+        Args:
+          num_workers: Number of VAD models and worker threads, the number of cores
+            by default.
+          decoder_backend: The decoder backend of the models, see `SileroVADModel`.
+          batch_size: Maximum number of audios of similar lengths batched in a single
+            call of a model.
+        """
+        cpu_count = os.cpu_count() or 1
+        self.num_workers = num_workers if num_workers is not None else cpu_count
+        self.batch_size = batch_size
+
+        encoder_path = os.path.join(get_assets_path(), "silero_encoder_v5.onnx")
+        decoder_path = os.path.join(get_assets_path(), "silero_decoder_v5.onnx")
+        self.models = queue.Queue()
+        for _ in range(self.num_workers):
+            self.models.put(
+                SileroVADModel(
+                    encoder_path,
+                    decoder_path,
+                    decoder_backend=decoder_backend,
+                    intra_op_num_threads=max(1, cpu_count // self.num_workers),
+                )
+            )
+        self.executor = ThreadPoolExecutor(max_workers=self.num_workers)
+
+    def get_speech_timestamps(
+        self,
+        audio: np.ndarray,
+        vad_options: Optional[VadOptions] = None,
+        sampling_rate: int = 16000,
+        **kwargs,
+    ) -> List[dict]:
+        """`get_speech_timestamps` on a model of the pool, such that concurrent
+        callers do not share a session."""
+        model = self.models.get()
+        try:
+            return get_speech_timestamps(
+                audio, vad_options, sampling_rate, model=model, **kwargs
+            )
+        finally:
+            self.models.put(model)
+
+    def get_speech_timestamps_many(
+        self,
+        audios: List[np.ndarray],
+        vad_options: Optional[VadOptions] = None,
+        sampling_rate: int = 16000,
+        **kwargs,
+    ) -> List[List[dict]]:
+        """Splits several audios into speech chunks, as `get_speech_timestamps` does
+        for each of them.
+
+        The audios are sorted by length and grouped in batches of `batch_size`, so the
+        batches are padded little, and the batches are spread over the workers.
+
+        Returns:
+          The speech chunks of each audio, in the order of `audios`.
+        """
+        if vad_options is None:
+            vad_options = VadOptions(**kwargs)
+
+        order = np.argsort([len(audio) for audio in audios], kind="stable").tolist()
+        # the energy gate runs per audio, so batching would not share any model call
+        batch_size = 1 if vad_options.energy_gate else self.batch_size
+        batches = [
+            order[i : i + batch_size] for i in range(0, len(order), batch_size)
+        ]
+
+        def run(batch):
+            model = self.models.get()
+            try:
+                if vad_options.energy_gate:
+                    speech_probs = [
+                        get_gated_speech_probs(
+                            audios[i], vad_options, sampling_rate, model=model
+                        )
+                        for i in batch
+                    ]
+                else:
+                    speech_probs = get_speech_probs(
+                        [audios[i] for i in batch], model=model
+                    )
+            finally:
+                self.models.put(model)
+            return [
+                get_speech_timestamps_from_probs(
+                    probs, len(audios[i]), vad_options, sampling_rate
+                )
+                for probs, i in zip(speech_probs, batch)
+            ]
+
+        speech_chunks = [None] * len(audios)
+        for batch, batch_chunks in zip(batches, self.executor.map(run, batches)):
+            for i, chunks in zip(batch, batch_chunks):
+                speech_chunks[i] = chunks
+        return speech_chunks
+
+
+@functools.lru_cache
+def get_vad_pool(num_workers: Optional[int] = None, decoder_backend: str = "onnx"):
+    """Returns the VAD session pool instance."""
+    return VadSessionPool(num_workers, decoder_backend=decoder_backend)
+
+
+def get_speech_timestamps_many(
+    audios: List[np.ndarray],
+    vad_options: Optional[VadOptions] = None,
+    sampling_rate: int = 16000,
+    **kwargs,
+) -> List[List[dict]]:
+    """`get_speech_timestamps` on several audios at once, spread over the cores by the
+    `VadSessionPool` of `get_vad_pool()`."""
+    return get_vad_pool().get_speech_timestamps_many(
+        audios, vad_options, sampling_rate, **kwargs
+    )
+
+
+def get_speech_probs(
+    audios: List[np.ndarray],
+    window_size_samples: int = 512,
+    model: Optional["SileroVADModel"] = None,
+) -> List[np.ndarray]:
+    """Computes the silero speech probabilities of several audios in a single pass.
+
+    The audios are zero-padded to a common number of windows and stacked as the batch
+    dimension, so each decoder step covers all files at once. Padding only follows the
+    end of each audio and the decoder is causal, so the probabilities of each audio are
+    the same as when it is processed on its own.
+
+    Args:
+      audios: One dimensional float arrays.
+      window_size_samples: Number of samples in each VAD window.
+      model: The VAD model to run, `get_vad_model()` by default.
+
+    Returns:
+      The speech probabilities of each audio, of shape (num_windows, 1).
+    """
+    if not audios:
+        return []
+
+    # as in `get_speech_timestamps`, each audio is padded past its last full window
+    num_windows = [len(audio) // window_size_samples + 1 for audio in audios]
+    batched_audio = np.zeros(
+        (len(audios), max(num_windows) * window_size_samples), dtype=np.float32
+    )
+    for i, audio in enumerate(audios):
+        batched_audio[i, : len(audio)] = audio
+
+    if model is None:
+        model = get_vad_model()
+    speech_probs = model(batched_audio, num_samples=window_size_samples)
+    return [probs[:n] for probs, n in zip(speech_probs, num_windows)]
+
+
+def get_energy_gate_regions(
+    audio: np.ndarray,
+    vad_options: VadOptions,
+    sampling_rate: int = 16000,
+    window_size_samples: int = 512,
+) -> List[Tuple[int, int]]:
+    """Finds the regions of the audio silero VAD has to run on, with an energy gate.
+
+    The energy of each window is compared to a noise floor estimated as the 10th
+    percentile of the window energies, capped at `energy_gate_max_floor_db` dBFS. Runs
+    of windows less than `energy_gate_margin_db` above it and longer than
+    `energy_gate_min_silence_ms` (plus `energy_gate_edge_ms` on each side) are gated,
+    all other windows are returned as regions.
+
+    Returns:
+      The (start, end) window indices of the regions, over the `len(audio) //
+      window_size_samples + 1` windows of `get_speech_probs`.
+    """
+    num_windows = len(audio) // window_size_samples + 1
+    windows = np.zeros(num_windows * window_size_samples, dtype=np.float32)
+    windows[: len(audio)] = audio
+    windows = windows.reshape(num_windows, window_size_samples)
+
+    power = np.mean(np.square(windows, dtype=np.float64), axis=1)
+    energy_db = 10 * np.log10(power + 1e-12)
+    noise_floor_db = min(
+        np.percentile(energy_db, 10), vad_options.energy_gate_max_floor_db
+    )
+    quiet = energy_db < noise_floor_db + vad_options.energy_gate_margin_db
+
+    # run-length encoding of the quiet windows
+    edges = np.diff(np.concatenate([[False], quiet, [False]]).astype(np.int8))
+    edges = np.flatnonzero(edges)
+    quiet_starts, quiet_ends = edges[::2], edges[1::2]
+
+    samples_per_ms = sampling_rate / 1000
+    min_windows = vad_options.energy_gate_min_silence_ms * samples_per_ms
+    min_windows = int(np.ceil(min_windows / window_size_samples))
+    margin_windows = vad_options.energy_gate_edge_ms * samples_per_ms
+    margin_windows = int(np.ceil(margin_windows / window_size_samples))
+    gated = quiet_ends - quiet_starts >= min_windows + 2 * margin_windows
+    gated_starts = quiet_starts[gated] + margin_windows
+    gated_ends = quiet_ends[gated] - margin_windows
+
+    region_starts = np.concatenate([[0], gated_ends])
+    region_ends = np.concatenate([gated_starts, [num_windows]])
+    return [
+        (start, end)
+        for start, end in zip(region_starts.tolist(), region_ends.tolist())
+        if end > start
+    ]
+
+
+def get_gated_speech_probs(
+    audio: np.ndarray,
+    vad_options: VadOptions,
+    sampling_rate: int = 16000,
+    window_size_samples: int = 512,
+    context_size_samples: int = 64,
+    model: Optional["SileroVADModel"] = None,
+) -> np.ndarray:
+    """Speech probabilities of `get_speech_probs`, with silero VAD only run on the
+    regions of `get_energy_gate_regions`. The gated windows get a probability of 0.
+
+    The recurrent state of silero keeps a long memory of the silence it went through,
+    so it is still carried over the gated stretches: only the first window of a stretch
+    is encoded, and the (cheap) decoder runs over that encoding repeated for the length
+    of the stretch, instead of the (costly) encoder running on every quiet window.
+    """
+    num_windows = len(audio) // window_size_samples + 1
+    padded_audio = np.zeros(
+        num_windows * window_size_samples + context_size_samples, dtype=np.float32
+    )
+    # the windows start after `context_size_samples` zeros, the context of the first one
+    padded_audio[context_size_samples : context_size_samples + len(audio)] = audio
+
+    def windows(start, end):
+        start_sample = start * window_size_samples + context_size_samples
+        end_sample = end * window_size_samples + context_size_samples
+        context = padded_audio[start_sample - context_size_samples : start_sample]
+        return padded_audio[None, start_sample:end_sample], context[None]
+
+    if model is None:
+        model = get_vad_model()
+    speech_probs = np.zeros((num_windows, 1), dtype=np.float32)
+    state = np.zeros((2, 1, 128), dtype=np.float32)
+    previous_end = 0
+    for start, end in get_energy_gate_regions(
+        audio, vad_options, sampling_rate, window_size_samples
+    ):
+        if start > previous_end:
+            quiet_encoding = model.encode(*windows(previous_end, previous_end + 1))
+            quiet_encoding = np.repeat(quiet_encoding, start - previous_end, axis=1)
+            _, state = model.decode(quiet_encoding, state)
+        region_probs, _, state = model.stream(*windows(start, end), state)
+        speech_probs[start:end] = region_probs[0]
+        previous_end = end
+    return speech_probs
+
+
+@functools.lru_cache
+def _get_jax_decoder():
+    """Returns the jitted LSTM decoder, scanned over a chunk of windows."""
+    import jax
+    import jax.numpy as jnp
+
+    def decode(weights, encoder_output, state, num_valid):
+        # the input projection of the LSTM does not depend on the state, so it is
+        # computed for all windows in one matmul and only the recurrence is scanned
+        input_gates = encoder_output @ weights["rnn.weight_ih"].T
+        input_gates = input_gates + weights["rnn.bias_ih"]
+
+        def step(carry, inputs):
+            window_gates, valid = inputs
+            h, c = carry
+            gates = window_gates + h @ weights["rnn.weight_hh"].T
+            gates = gates + weights["rnn.bias_hh"]
+            i, f, g, o = jnp.split(gates, 4, axis=-1)
+            next_c = jax.nn.sigmoid(f) * c + jax.nn.sigmoid(i) * jnp.tanh(g)
+            next_h = jax.nn.sigmoid(o) * jnp.tanh(next_c)
+            # the state is frozen on the padding windows of the last chunk
+            h = jnp.where(valid, next_h, h)
+            c = jnp.where(valid, next_c, c)
+            return (h, c), next_h
+
+        valid = jnp.arange(encoder_output.shape[1]) < num_valid
+        (h, c), hidden_states = jax.lax.scan(
+            step, (state[0], state[1]), (jnp.swapaxes(input_gates, 0, 1), valid)
+        )
+        logits = jax.nn.relu(hidden_states) @ weights["conv1d.weight"][0]
+        probs = jax.nn.sigmoid(logits + weights["conv1d.bias"])
+        return jnp.swapaxes(probs, 0, 1), jnp.stack([h, c])
+
+    return jax.jit(decode)
 
 
 class SileroVADModel:
-    def __init__(self, encoder_path, decoder_path):
+    def __init__(
+        self,
+        encoder_path,
+        decoder_path,
+        decoder_backend: str = "onnx",
+        decoder_chunk_size: int = 4096,
+        intra_op_num_threads: int = 0,
+    ):
+        """Silero VAD v5, split into a convolutional encoder and a recurrent decoder.
+
+        Args:
+          encoder_path: Path to the ONNX encoder.
+          decoder_path: Path to the ONNX decoder.
+          decoder_backend: "onnx" runs the decoder session once per 32ms window step.
+            "jax" runs the same LSTM with the weights exported from the ONNX decoder
+            as a jitted `lax.scan` on the CPU, `decoder_chunk_size` windows per call,
+            which removes the per-window Python and session overhead.
+          decoder_chunk_size: Number of windows decoded per call of the "jax" backend.
+            Fixed-size chunks (the last one being zero-padded) keep a single compiled
+            executable per batch size, whatever the length of the audio. Inputs shorter
+            than a chunk are padded to the next power of two instead.
+          intra_op_num_threads: Number of threads of the ONNX sessions, 0 to let
+            onnxruntime use all cores. Models running concurrently (see
+            `VadSessionPool`) should share the cores instead.
+        """
         try:
             import onnxruntime
         except ImportError as e:
@@ -261,9 +786,17 @@ class SileroVADModel:
                 "Applying the VAD filter requires the onnxruntime package"
             ) from e
 
+        if decoder_backend not in ("onnx", "jax"):
+            raise ValueError(
+                f"Unknown VAD decoder backend {decoder_backend}, "
+                "expected 'onnx' or 'jax'"
+            )
+        self.decoder_backend = decoder_backend
+        self.decoder_chunk_size = decoder_chunk_size
+
         opts = onnxruntime.SessionOptions()
         opts.inter_op_num_threads = 0
-        opts.intra_op_num_threads = 0
+        opts.intra_op_num_threads = intra_op_num_threads
         opts.log_severity_level = 4
 
         self.encoder_session = onnxruntime.InferenceSession(
@@ -271,11 +804,34 @@ class SileroVADModel:
             providers=["CPUExecutionProvider"],
             sess_options=opts,
         )
-        self.decoder_session = onnxruntime.InferenceSession(
-            decoder_path,
-            providers=["CPUExecutionProvider"],
-            sess_options=opts,
-        )
+        if decoder_backend == "onnx":
+            self.decoder_session = onnxruntime.InferenceSession(
+                decoder_path,
+                providers=["CPUExecutionProvider"],
+                sess_options=opts,
+            )
+        else:
+            self.decoder_weights = self._load_decoder_weights(decoder_path)
+
+    @staticmethod
+    def _load_decoder_weights(decoder_path):
+        try:
+            import jax
+            import onnx
+            from onnx import numpy_helper
+        except ImportError as e:
+            raise RuntimeError(
+                "The jax VAD decoder requires the jax and onnx packages"
+            ) from e
+
+        graph = onnx.load(decoder_path).graph
+        weights = {
+            tensor.name: numpy_helper.to_array(tensor)
+            for tensor in graph.initializer
+            if tensor.name.startswith(("rnn.", "conv1d."))
+        }
+        # the decoder is tiny and strictly sequential, so it runs on the host CPU
+        return jax.device_put(weights, jax.devices("cpu")[0])
 
     def __call__(
         self, audio: np.ndarray, num_samples: int = 512, context_size_samples: int = 64
@@ -306,6 +862,62 @@ class SileroVADModel:
         encoder_output = self.encoder_session.run(None, {"input": batched_audio})[0]
         encoder_output = encoder_output.reshape(batch_size, -1, 128)
 
+        out, state = self.decode(encoder_output, state)
+        return out
+
+    def stream(
+        self,
+        audio: np.ndarray,
+        context: np.ndarray,
+        state: np.ndarray,
+        num_samples: int = 512,
+    ):
+        """Runs the VAD on the next windows of audio streams.
+
+        Args:
+          audio: Array of shape (batch_size, num_windows * num_samples), following the
+            audio of the previous call.
+          context: The last context_size_samples samples before `audio`, of shape
+            (batch_size, context_size_samples), zeros at the start of the streams.
+          state: The decoder state after the previous call, of shape
+            (2, batch_size, 128), zeros at the start of the streams.
+
+        Returns:
+          The speech probabilities of shape (batch_size, num_windows, 1), and the
+          context and decoder state to pass to the next call.
+        """
+        encoder_output = self.encode(audio, context, num_samples)
+        out, state = self.decode(encoder_output, state)
+        return out, audio[:, -context.shape[1] :].copy(), state
+
+    def encode(self, audio: np.ndarray, context: np.ndarray, num_samples: int = 512):
+        """Runs the encoder on the windows of `audio` of shape
+        (batch_size, num_windows * num_samples), preceded by the `context` samples.
+
+        Returns the encoder outputs of shape (batch_size, num_windows, 128).
+        """
+        batch_size = audio.shape[0]
+        context_size_samples = context.shape[1]
+
+        windows = audio.reshape(batch_size, -1, num_samples)
+        contexts = np.concatenate(
+            [context[:, None], windows[:, :-1, -context_size_samples:]], axis=1
+        )
+        batched_audio = np.concatenate([contexts, windows], 2).astype(np.float32)
+        batched_audio = batched_audio.reshape(-1, num_samples + context_size_samples)
+
+        encoder_output = self.encoder_session.run(None, {"input": batched_audio})[0]
+        return encoder_output.reshape(batch_size, -1, 128)
+
+    def decode(self, encoder_output: np.ndarray, state: np.ndarray):
+        """Runs the recurrent decoder over encoder outputs (batch_size, num_windows, 128).
+
+        Returns the speech probabilities of shape (batch_size, num_windows, 1) and the
+        decoder state after the last window.
+        """
+        if self.decoder_backend == "jax":
+            return self._decode_jax(encoder_output, state)
+
         decoder_outputs = []
         for window in np.split(encoder_output, encoder_output.shape[1], axis=1):
             out, state = self.decoder_session.run(
@@ -314,7 +926,149 @@ class SileroVADModel:
             decoder_outputs.append(out)
 
         out = np.stack(decoder_outputs, axis=1).squeeze(-1)
-        return out
+        return out, state
+
+    def _decode_jax(self, encoder_output: np.ndarray, state: np.ndarray):
+        import jax
+
+        decoder = _get_jax_decoder()
+        cpu = jax.devices("cpu")[0]
+        num_windows = encoder_output.shape[1]
+        # short inputs (e.g. streaming blocks) are padded to the next power of two only
+        chunk_size = 1 << max(num_windows - 1, 0).bit_length()
+        chunk_size = min(self.decoder_chunk_size, chunk_size)
+
+        decoder_outputs = [np.zeros((encoder_output.shape[0], 0, 1), dtype=np.float32)]
+        state = jax.device_put(state, cpu)
+        for start in range(0, num_windows, chunk_size):
+            chunk = encoder_output[:, start : start + chunk_size]
+            num_valid = chunk.shape[1]
+            if num_valid < chunk_size:
+                chunk = np.pad(chunk, ((0, 0), (0, chunk_size - num_valid), (0, 0)))
+            out, state = decoder(
+                self.decoder_weights, jax.device_put(chunk, cpu), state, num_valid
+            )
+            decoder_outputs.append(np.asarray(out)[:, :num_valid])
+
+        return np.concatenate(decoder_outputs, axis=1), np.asarray(state)
+
+
+class StreamingVad:
+    """Silero VAD over an audio stream fed in blocks of any size.
+
+    The decoder state and the context samples are carried from one block to the next,
+    and the speech state machine runs incrementally, so memory stays bounded whatever
+    the length of the stream. A speech chunk is emitted as soon as it is final: once
+    `min_silence_duration_ms` of silence closed it (or it was split at
+    `max_speech_duration_s`), and the stream went far enough to fix its padding, i.e.
+    `2 * speech_pad_ms` past its end or up to the start of the next chunk. The emitted
+    chunks, in samples since the start of the stream, are the ones
+    `get_speech_timestamps` returns for the whole audio.
+
+    ```python
+    streaming_vad = StreamingVad(vad_options)
+    for block in blocks:
+        for chunk in streaming_vad(block):
+            ...
+    for chunk in streaming_vad.flush():
+        ...
+    ```
+    """
+
+    def __init__(
+        self,
+        vad_options: Optional[VadOptions] = None,
+        sampling_rate: int = 16000,
+        model: Optional[SileroVADModel] = None,
+        window_size_samples: int = 512,
+        context_size_samples: int = 64,
+    ):
+        self.vad_options = vad_options if vad_options is not None else VadOptions()
+        self.sampling_rate = sampling_rate
+        self.model = model if model is not None else get_vad_model()
+        self.window_size_samples = window_size_samples
+        self.context_size_samples = context_size_samples
+        self.reset()
+
+    def reset(self):
+        """Starts a new stream."""
+        self.segmenter = SpeechSegmenter(
+            self.vad_options, self.sampling_rate, self.window_size_samples
+        )
+        self.state = np.zeros((2, 1, 128), dtype=np.float32)
+        self.context = np.zeros((1, self.context_size_samples), dtype=np.float32)
+        self.buffer = np.zeros(0, dtype=np.float32)
+        self.num_samples = 0
+        # end of the last emitted chunk, before padding
+        self.last_end = None
+
+    def __call__(self, audio: np.ndarray) -> List[dict]:
+        """Feeds the next samples of the stream, and returns the chunks made final."""
+        audio = np.asarray(audio, dtype=np.float32).reshape(-1)
+        self.num_samples += len(audio)
+        self.buffer = np.concatenate([self.buffer, audio])
+
+        num_windows = len(self.buffer) // self.window_size_samples
+        if num_windows:
+            num_window_samples = num_windows * self.window_size_samples
+            self._push(self.buffer[:num_window_samples])
+            self.buffer = self.buffer[num_window_samples:]
+        return self._emit()
+
+    def flush(self) -> List[dict]:
+        """Ends the stream, returns the remaining chunks and resets for a new stream."""
+        # as in `get_speech_probs`, the audio is padded past its last full window
+        last_window = np.zeros(self.window_size_samples, dtype=np.float32)
+        last_window[: len(self.buffer)] = self.buffer
+        self._push(last_window)
+        self.segmenter.finish(self.num_samples)
+
+        speeches = self._emit(final=True)
+        self.reset()
+        return speeches
+
+    def _push(self, audio):
+        speech_probs, self.context, self.state = self.model.stream(
+            audio[None], self.context, self.state, self.window_size_samples
+        )
+        self.segmenter.push(speech_probs[0])
+
+    def _emit(self, final=False):
+        speech_pad_samples = self.segmenter.speech_pad_samples
+        pending = self.segmenter.speeches
+        speeches = []
+        while pending:
+            speech = pending[0]
+            if len(pending) > 1:
+                next_start = pending[1]["start"]
+            elif final:
+                next_start = None
+            else:
+                # the next chunk cannot start before the open one, or the next window
+                next_start = self.segmenter.current_speech.get(
+                    "start", self.segmenter.num_windows * self.window_size_samples
+                )
+                if next_start - speech["end"] < 2 * speech_pad_samples:
+                    break
+
+            # the padding of `pad_speeches`, one chunk at a time
+            if self.last_end is None:
+                start = speech["start"] - speech_pad_samples
+            elif speech["start"] - self.last_end < 2 * speech_pad_samples:
+                start = speech["start"] - (speech["start"] - self.last_end) // 2
+            else:
+                start = speech["start"] - speech_pad_samples
+            if next_start is not None and (
+                next_start - speech["end"] < 2 * speech_pad_samples
+            ):
+                end = speech["end"] + (next_start - speech["end"]) // 2
+            else:
+                end = min(self.num_samples, speech["end"] + speech_pad_samples)
+
+            speeches.append({"start": int(max(0, start)), "end": int(end)})
+            self.last_end = speech["end"]
+            pending.pop(0)
+        return speeches
 
 
 def merge_segments(segments_list, vad_options: VadOptions, sampling_rate: int = 16000):
@@ -359,4 +1113,40 @@ def merge_segments(segments_list, vad_options: VadOptions, sampling_rate: int =
             "segments": seg_idxs,
         }
     )
-    return merged_segments
\ No newline at end of file
+    return merged_segments
+
+
+def pack_segments(segments_list, vad_options: VadOptions, sampling_rate: int = 16000):
+    """Packs consecutive speech segments into windows holding at most
+    `max_speech_duration_s` of speech, whatever the silence between them.
+
+    Unlike `merge_segments`, the silence is not part of the windows: their audio is the
+    concatenation of their segments (see `collect_chunks`), and `SpeechTimestampsMap`
+    restores the original timestamps. Sparse audio then fills far fewer windows.
+    """
+    if not segments_list:
+        return []
+
+    chunk_length = vad_options.max_speech_duration_s * sampling_rate
+
+    packed_segments = []
+    curr_segments = []
+    curr_duration = 0
+    for seg in segments_list:
+        duration = seg["end"] - seg["start"]
+        if curr_segments and curr_duration + duration > chunk_length:
+            packed_segments.append(curr_segments)
+            curr_segments = []
+            curr_duration = 0
+        curr_segments.append({"start": seg["start"], "end": seg["end"]})
+        curr_duration += duration
+    packed_segments.append(curr_segments)
+
+    return [
+        {
+            "start": segments[0]["start"],
+            "end": segments[-1]["end"],
+            "segments": segments,
+        }
+        for segments in packed_segments
+    ]
@@ -0,0 +1,139 @@
+import os
+import sys
+from dataclasses import dataclass
+
+import numpy as np
+import pytest
+
+
+# the infer scripts import each other as top-level modules
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "infer"))
+
+from align import align_emissions_batch, next_power_of_two  # noqa: E402
+
+
+# NumPy reference implementation of CTC forced alignment, from
+# https://pytorch.org/tutorials/intermediate/forced_alignment_with_torchaudio_tutorial.html
+
+
+def get_trellis(emission, tokens, blank_id=0):
+    num_frame = emission.shape[0]
+    num_tokens = len(tokens)
+
+    # Trellis has extra diemsions for both time axis and tokens.
+    # The extra dim for tokens represents <SoS> (start-of-sentence)
+    # The extra dim for time axis is for simplification of the code.
+    trellis = np.empty((num_frame + 1, num_tokens + 1))
+    trellis[0, 0] = 0
+    trellis[1:, 0] = np.cumsum(emission[:, 0], 0)
+    trellis[0, -num_tokens:] = -float("inf")
+    trellis[-num_tokens:, 0] = float("inf")
+
+    for t in range(num_frame):
+        trellis[t + 1, 1:] = np.maximum(
+            # Score for staying at the same token
+            trellis[t, 1:] + emission[t, blank_id],
+            # Score for changing to the next token
+            trellis[t, :-1] + emission[t, tokens],
+        )
+    return trellis
+
+
+@dataclass
+class Point:
+    token_index: int
+    time_index: int
+    score: float
+
+
+def backtrack(trellis, emission, tokens, blank_id=0):
+    # j and t are indices for trellis, which has extra dimensions for time and tokens at the beginning.
+    j = trellis.shape[1] - 1
+    t_start = np.argmax(trellis[:, j])
+
+    path = []
+    for t in range(t_start, 0, -1):
+        # 1. Figure out if the current position was stay or change
+        stayed = trellis[t - 1, j] + emission[t - 1, blank_id]
+        changed = trellis[t - 1, j - 1] + emission[t - 1, tokens[j - 1]]
+
+        # 2. Store the path with frame-wise probability.
+        prob = np.exp(emission[t - 1, tokens[j - 1] if changed > stayed else 0])
+        path.append(Point(j - 1, t - 1, prob))
+
+        # 3. Update the token
+        if changed > stayed:
+            j -= 1
+            if j == 0:
+                break
+    else:
+        # failed
+        return None
+    return path[::-1]
+
+
+def merge_repeats(path):
+    # the segments of consecutive frames of the same token, labelled with the token index
+    i1, i2 = 0, 0
+    segments = []
+    while i1 < len(path):
+        while i2 < len(path) and path[i1].token_index == path[i2].token_index:
+            i2 += 1
+        score = sum(path[k].score for k in range(i1, i2)) / (i2 - i1)
+        segments.append((path[i1].token_index, path[i1].time_index, path[i2 - 1].time_index + 1, score))
+        i1 = i2
+    return segments
+
+
+def random_case(rng, vocab_size=40):
+    num_frames = rng.randint(1, 400)
+    # a tenth of the cases have more tokens than frames, such that the backtrack fails
+    num_tokens = rng.randint(1, 60) if rng.rand() > 0.1 else rng.randint(num_frames, num_frames + 5)
+    tokens = rng.randint(1, vocab_size, num_tokens).tolist()
+
+    # peaky emissions along a monotone token path, as a CTC model gives
+    logits = 2 * rng.randn(num_frames, vocab_size)
+    positions = np.sort(rng.randint(0, num_frames, min(num_tokens, num_frames)))
+    logits[positions, tokens[: len(positions)]] += 8
+    logits[:, 0] += 2
+    logits -= logits.max(-1, keepdims=True)
+    emission = logits - np.log(np.exp(logits).sum(-1, keepdims=True))
+    return emission.astype(np.float32), tokens
+
+
+@pytest.mark.parametrize("seed", range(4))
+def test_ctc_align_matches_reference(seed):
+    rng = np.random.RandomState(seed)
+    cases = [random_case(rng) for _ in range(100)]
+
+    batch_size = 16
+    for i in range(0, len(cases), batch_size):
+        batch = cases[i : i + batch_size]
+        num_frames = [emission.shape[0] for emission, _ in batch]
+        emissions = np.zeros((batch_size, next_power_of_two(max(num_frames)), batch[0][0].shape[-1]), np.float32)
+        for row, (emission, _) in enumerate(batch):
+            emissions[row, : emission.shape[0]] = emission
+
+        char_segments = align_emissions_batch(emissions, [tokens for _, tokens in batch], num_frames)
+
+        for (emission, tokens), segments in zip(batch, char_segments):
+            path = backtrack(get_trellis(emission, tokens), emission, tokens)
+            if path is None:
+                assert segments is None
+                continue
+            expected = merge_repeats(path)
+            assert [(s.label, s.start, s.end) for s in segments] == [(k, start, end) for k, start, end, _ in expected]
+            np.testing.assert_allclose(
+                [s.score for s in segments], [score for *_, score in expected], rtol=0, atol=1e-6
+            )
+
+
+def test_empty_rows_are_not_aligned():
+    rng = np.random.RandomState(0)
+    emission, tokens = random_case(rng)
+    emissions = np.zeros((2, next_power_of_two(emission.shape[0]), emission.shape[-1]), np.float32)
+    emissions[0, : emission.shape[0]] = emission
+
+    char_segments = align_emissions_batch(emissions, [tokens, []], [emission.shape[0], 0])
+
+    assert char_segments[1] is None
@@ -0,0 +1,58 @@
+import jax
+import numpy as np
+import pytest
+from transformers import WhisperFeatureExtractor
+
+from whisper_jax import FlaxWhisperFeatureExtractor
+
+
+SAMPLING_RATE = 16000
+
+# the JAX STFT runs in float32, the `transformers` one in float64
+ATOL = 1e-4
+
+
+def synthetic_audio(num_seconds, seed=0):
+    # a gliding tone under amplitude modulation plus noise, so every mel bin sees some energy
+    rng = np.random.RandomState(seed)
+    t = np.arange(int(num_seconds * SAMPLING_RATE)) / SAMPLING_RATE
+    tone = (
+        0.3 * np.sin(2 * np.pi * (200 + 300 * t / max(num_seconds, 1)) * t) * (0.6 + 0.4 * np.sin(2 * np.pi * 3 * t))
+    )
+    return (tone + 0.05 * rng.randn(t.shape[0])).astype(np.float32)
+
+
+@pytest.mark.parametrize("feature_size", [80, 128])
+@pytest.mark.parametrize(
+    "num_seconds",
+    [
+        pytest.param(4.5, id="short"),
+        pytest.param(30, id="exactly_30s"),
+        pytest.param(37, id="longer_than_30s"),
+    ],
+)
+def test_log_mel_matches_transformers(feature_size, num_seconds):
+    hf_extractor = WhisperFeatureExtractor(feature_size=feature_size)
+    extractor = FlaxWhisperFeatureExtractor.from_feature_extractor(hf_extractor)
+    audio = synthetic_audio(num_seconds)
+
+    expected = hf_extractor(audio, sampling_rate=SAMPLING_RATE, return_tensors="np").input_features
+    features = np.asarray(jax.jit(extractor)(extractor.pad(audio)))
+
+    assert features.shape == expected.shape == (1, feature_size, extractor.nb_max_frames)
+    np.testing.assert_allclose(features, expected, rtol=0, atol=ATOL)
+
+
+@pytest.mark.parametrize("feature_size", [80, 128])
+def test_padded_batch_matches_transformers(feature_size):
+    hf_extractor = WhisperFeatureExtractor(feature_size=feature_size)
+    extractor = FlaxWhisperFeatureExtractor.from_feature_extractor(hf_extractor)
+    # inputs of different lengths, zero-padded together into one batch, including pure silence
+    batch = [synthetic_audio(12, seed=1), synthetic_audio(30, seed=2), np.zeros(5 * SAMPLING_RATE, np.float32)]
+
+    expected = hf_extractor(batch, sampling_rate=SAMPLING_RATE, return_tensors="np").input_features
+    padded = extractor.pad(batch)
+    features = np.asarray(jax.jit(extractor)(padded))
+
+    assert padded.shape == (len(batch), extractor.n_samples)
+    np.testing.assert_allclose(features, expected, rtol=0, atol=ATOL)
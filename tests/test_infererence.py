@@ -0,0 +1,82 @@
+import os
+import sys
+
+import jax
+import numpy as np
+import pytest
+from jax.experimental import mesh_utils
+from jax.sharding import Mesh
+from transformers import FlaxWav2Vec2ForCTC, Wav2Vec2Config
+
+
+# the infer scripts import each other as top-level modules
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "infer"))
+
+import infererence  # noqa: E402
+
+
+SAMPLING_RATE = 16000
+CHARACTERS = "<pad> <s> </s> <unk> | a b c d e f g h i j k l m n o p q r s t u v w x y z '".split(" ")
+
+
+def tiny_align_model(language_code):
+    # a randomly initialised wav2vec2 CTC model over a character vocabulary, as `load_align_model` returns
+    config = Wav2Vec2Config(
+        vocab_size=len(CHARACTERS),
+        hidden_size=32,
+        num_hidden_layers=2,
+        num_attention_heads=2,
+        intermediate_size=64,
+        conv_dim=(16,) * 7,
+        num_conv_pos_embeddings=16,
+        num_conv_pos_embedding_groups=2,
+        do_stable_layer_norm=True,
+        feat_extract_norm="layer",
+    )
+    metadata = {
+        "language": language_code,
+        "dictionary": {char: code for code, char in enumerate(CHARACTERS)},
+        "type": "huggingface",
+    }
+    return FlaxWav2Vec2ForCTC(config, seed=0), metadata
+
+
+@pytest.fixture
+def loaded_languages(monkeypatch):
+    loaded = []
+
+    def load_align_model(language_code):
+        loaded.append(language_code)
+        return tiny_align_model(language_code)
+
+    monkeypatch.setattr(infererence, "load_align_model", load_align_model)
+    return loaded
+
+
+def test_unsupported_language_group_is_left_unaligned(loaded_languages):
+    audio = (0.1 * np.random.RandomState(0).randn(20 * SAMPLING_RATE)).astype(np.float32)
+    language_groups = {
+        "<|en|>": [
+            {"start": 0, "end": 4 * SAMPLING_RATE, "text": " hello world"},
+            {"start": 12 * SAMPLING_RATE, "end": 18 * SAMPLING_RATE, "text": " the quick brown fox"},
+        ],
+        # a short segment misdetected as a language without a default alignment model
+        "<|la|>": [{"start": 5 * SAMPLING_RATE, "end": 6 * SAMPLING_RATE, "text": " salve"}],
+    }
+    mesh = Mesh(mesh_utils.create_device_mesh((jax.device_count(), 1)), ("data", "model"))
+
+    segments = infererence.align_language_groups(
+        language_groups, infererence.AlignModelManager(num_devices=1), audio, mesh
+    )
+
+    assert loaded_languages == ["en"]
+    assert [segment["language"] for segment in segments] == ["<|en|>", "<|la|>", "<|en|>"]
+    assert segments[1] == {
+        "start": 5 * SAMPLING_RATE,
+        "end": 6 * SAMPLING_RATE,
+        "text": " salve",
+        "language": "<|la|>",
+    }
+    for segment in (segments[0], segments[2]):
+        assert [word["word"] for word in segment["words"]] == segment["text"].split()
+        assert all("start" in word and "end" in word for word in segment["words"])
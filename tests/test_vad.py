@@ -0,0 +1,175 @@
+import os
+import sys
+
+import numpy as np
+import pytest
+
+
+# the infer scripts import each other as top-level modules
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "infer"))
+
+from vad import SpeechSegmenter, VadOptions, get_speech_timestamps_from_probs, pad_speeches  # noqa: E402
+
+
+SAMPLING_RATE = 16000
+WINDOW_SIZE_SAMPLES = 512
+
+
+def reference_speech_timestamps(speech_probs, audio_length_samples, vad_options, sampling_rate=SAMPLING_RATE):
+    """The window-by-window state machine of silero VAD, as `get_speech_timestamps` ran it before it was vectorized."""
+    threshold = vad_options.threshold
+    min_speech_duration_ms = vad_options.min_speech_duration_ms
+    max_speech_duration_s = vad_options.max_speech_duration_s
+    min_silence_duration_ms = vad_options.min_silence_duration_ms
+    window_size_samples = WINDOW_SIZE_SAMPLES
+    speech_pad_ms = vad_options.speech_pad_ms
+    min_speech_samples = sampling_rate * min_speech_duration_ms / 1000
+    speech_pad_samples = sampling_rate * speech_pad_ms / 1000
+    max_speech_samples = sampling_rate * max_speech_duration_s - window_size_samples - 2 * speech_pad_samples
+    min_silence_samples = sampling_rate * min_silence_duration_ms / 1000
+    min_silence_samples_at_max_speech = sampling_rate * 98 / 1000
+
+    triggered = False
+    speeches = []
+    current_speech = {}
+    neg_threshold = vad_options.neg_threshold
+
+    # to save potential segment end (and tolerate some silence)
+    temp_end = 0
+    # to save potential segment limits in case of maximum segment size reached
+    prev_end = next_start = 0
+
+    for i, speech_prob in enumerate(speech_probs):
+        if (speech_prob >= threshold) and temp_end:
+            temp_end = 0
+            if next_start < prev_end:
+                next_start = window_size_samples * i
+
+        if (speech_prob >= threshold) and not triggered:
+            triggered = True
+            current_speech["start"] = window_size_samples * i
+            continue
+
+        if triggered and (window_size_samples * i) - current_speech["start"] > max_speech_samples:
+            if prev_end:
+                current_speech["end"] = prev_end
+                speeches.append(current_speech)
+                current_speech = {}
+                # previously reached silence (< neg_thres) and is still not speech (< thres)
+                if next_start < prev_end:
+                    triggered = False
+                else:
+                    current_speech["start"] = next_start
+                prev_end = next_start = temp_end = 0
+            else:
+                current_speech["end"] = window_size_samples * i
+                speeches.append(current_speech)
+                current_speech = {}
+                prev_end = next_start = temp_end = 0
+                triggered = False
+                continue
+
+        if (speech_prob < neg_threshold) and triggered:
+            if not temp_end:
+                temp_end = window_size_samples * i
+            # condition to avoid cutting in very short silence
+            if (window_size_samples * i) - temp_end > min_silence_samples_at_max_speech:
+                prev_end = temp_end
+            if (window_size_samples * i) - temp_end < min_silence_samples:
+                continue
+            else:
+                current_speech["end"] = temp_end
+                if (current_speech["end"] - current_speech["start"]) > min_speech_samples:
+                    speeches.append(current_speech)
+                current_speech = {}
+                prev_end = next_start = temp_end = 0
+                triggered = False
+                continue
+
+    if current_speech and (audio_length_samples - current_speech["start"]) > min_speech_samples:
+        current_speech["end"] = audio_length_samples
+        speeches.append(current_speech)
+
+    for i, speech in enumerate(speeches):
+        if i == 0:
+            speech["start"] = int(max(0, speech["start"] - speech_pad_samples))
+        if i != len(speeches) - 1:
+            silence_duration = speeches[i + 1]["start"] - speech["end"]
+            if silence_duration < 2 * speech_pad_samples:
+                speech["end"] += int(silence_duration // 2)
+                speeches[i + 1]["start"] = int(max(0, speeches[i + 1]["start"] - silence_duration // 2))
+            else:
+                speech["end"] = int(min(audio_length_samples, speech["end"] + speech_pad_samples))
+                speeches[i + 1]["start"] = int(max(0, speeches[i + 1]["start"] - speech_pad_samples))
+        else:
+            speech["end"] = int(min(audio_length_samples, speech["end"] + speech_pad_samples))
+
+    return speeches
+
+
+def random_trace(rng, vad_options):
+    num_windows = rng.randint(1, 3000)
+    kind = rng.choice(["noise", "random_walk", "blocky", "between_thresholds"])
+    if kind == "noise":
+        probs = rng.rand(num_windows)
+    elif kind == "random_walk":
+        probs = np.clip(0.5 + np.cumsum(rng.randn(num_windows) * 0.05), 0, 1)
+    else:
+        # runs of windows of random lengths, as speech and pauses give
+        block_lengths = rng.geometric(1 / rng.choice([3, 20, 100]), size=num_windows)
+        block_ends = np.minimum(np.cumsum(block_lengths), num_windows)
+        levels = rng.rand(len(block_ends))
+        if kind == "between_thresholds":
+            # mostly in the hysteresis band, where the state depends on the windows before
+            low, high = vad_options.neg_threshold, vad_options.threshold
+            band = rng.rand(len(block_ends)) < 0.7
+            levels[band] = low + (high - low) * rng.rand(band.sum())
+        probs = np.repeat(levels, np.diff(np.concatenate([[0], block_ends])))[:num_windows]
+        probs = np.clip(probs + 0.02 * rng.randn(num_windows) * (rng.rand() < 0.5), 0, 1)
+    # `get_speech_probs` has `len(audio) // window_size_samples + 1` windows
+    audio_length_samples = (num_windows - 1) * WINDOW_SIZE_SAMPLES + rng.randint(0, WINDOW_SIZE_SAMPLES)
+    return probs.astype(np.float32), audio_length_samples
+
+
+def random_vad_options(rng):
+    threshold = rng.choice([0.3, 0.5, 0.7])
+    return VadOptions(
+        threshold=threshold,
+        neg_threshold=threshold - rng.choice([0.0, 0.1, 0.15, 0.3]),
+        min_speech_duration_ms=int(rng.choice([0, 250])),
+        max_speech_duration_s=rng.choice([float("inf"), 1.0, 3.0, 30.0]),
+        min_silence_duration_ms=int(rng.choice([0, 50, 100, 160, 500, 2000])),
+        speech_pad_ms=int(rng.choice([0, 30, 400])),
+    )
+
+
+def random_cases(seed, num_cases=150):
+    rng = np.random.RandomState(seed)
+    for _ in range(num_cases):
+        vad_options = random_vad_options(rng)
+        yield (vad_options, *random_trace(rng, vad_options), rng)
+
+
+@pytest.mark.parametrize("seed", range(4))
+def test_speech_timestamps_from_probs_match_reference(seed):
+    for vad_options, probs, audio_length_samples, _ in random_cases(seed):
+        expected = reference_speech_timestamps(probs, audio_length_samples, vad_options)
+        assert get_speech_timestamps_from_probs(probs, audio_length_samples, vad_options) == expected, vad_options
+
+
+@pytest.mark.parametrize("seed", range(4))
+def test_speech_segmenter_chunked_push_matches_reference(seed):
+    for vad_options, probs, audio_length_samples, rng in random_cases(seed):
+        expected = reference_speech_timestamps(probs, audio_length_samples, vad_options)
+
+        segmenter = SpeechSegmenter(vad_options, SAMPLING_RATE, WINDOW_SIZE_SAMPLES)
+        start = 0
+        while start < len(probs):
+            # single windows, a few seconds or long blocks, as a stream delivers them
+            end = start + rng.choice([1, rng.randint(1, 100), rng.randint(100, 1000)])
+            segmenter.push(probs[start:end])
+            start = end
+        segmenter.finish(audio_length_samples)
+        speeches = pad_speeches(segmenter.speeches, audio_length_samples, segmenter.speech_pad_samples)
+
+        assert speeches == expected, vad_options
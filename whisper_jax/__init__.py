@@ -15,6 +15,7 @@
 
 __version__ = "0.0.1"
 
+from .feature_extraction import FlaxWhisperFeatureExtractor
 from .modeling_flax_whisper import FlaxWhisperForConditionalGeneration
 from .partitioner import PjitPartitioner
 from .pipeline import FlaxWhisperPipline
@@ -0,0 +1,211 @@
+# coding=utf-8
+# Copyright 2023 The HuggingFace Inc. team.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Log-mel feature extraction for Whisper, on device (JAX) and for whole files on the host (NumPy)."""
+
+import jax.numpy as jnp
+import numpy as np
+from jax import lax
+from transformers.audio_utils import mel_filter_bank, window_function
+
+
+def log_mel_spectrogram(waveforms, mel_filters, window, n_fft=400, hop_length=160):
+    """
+    Computes the Whisper log-mel spectrogram of a batch of raw waveforms. This is a jittable port of the NumPy
+    implementation of [`WhisperFeatureExtractor`]: centered STFT with reflect padding and a periodic Hann window,
+    power spectrum projected onto the mel filterbank, `log10` clamped to 8 below the per-example maximum and rescaled.
+
+    Args:
+        waveforms (`jnp.ndarray` of shape `(batch_size, num_samples)`):
+            The raw mono waveforms, already padded / truncated to a common length.
+        mel_filters (`jnp.ndarray` of shape `(n_fft // 2 + 1, num_mel_bins)`):
+            The mel filterbank.
+        window (`jnp.ndarray` of shape `(n_fft,)`):
+            The STFT window.
+        n_fft (`int`, *optional*, defaults to 400):
+            Size of the Fourier transform.
+        hop_length (`int`, *optional*, defaults to 160):
+            Number of samples between successive STFT frames.
+
+    Returns:
+        `jnp.ndarray` of shape `(batch_size, num_mel_bins, num_samples // hop_length)`: the log-mel features.
+    """
+    waveforms = jnp.asarray(waveforms, dtype=jnp.float32)
+    # center the frames on the samples, i.e. `torch.stft(..., center=True, pad_mode="reflect")`
+    padded = jnp.pad(waveforms, ((0, 0), (n_fft // 2, n_fft // 2)), mode="reflect")
+
+    num_frames = 1 + (padded.shape[-1] - n_fft) // hop_length
+    frame_idx = hop_length * jnp.arange(num_frames)[:, None] + jnp.arange(n_fft)[None, :]
+    frames = padded[:, frame_idx] * window
+
+    stft = jnp.fft.rfft(frames, n=n_fft, axis=-1)
+    power_spec = jnp.real(stft) ** 2 + jnp.imag(stft) ** 2
+
+    # keep the filterbank projection in full precision - the default TPU precision would truncate to bfloat16
+    mel_spec = jnp.matmul(power_spec, mel_filters, precision=lax.Precision.HIGHEST)
+    log_spec = jnp.log10(jnp.maximum(mel_spec, 1e-10))
+
+    # the last frame is dropped, such that 30s of audio maps to exactly 3000 frames
+    log_spec = log_spec[:, :-1, :]
+    log_spec = jnp.maximum(log_spec, log_spec.max(axis=(1, 2), keepdims=True) - 8.0)
+    log_spec = (log_spec + 4.0) / 4.0
+
+    return log_spec.transpose(0, 2, 1)
+
+
+def np_log_mel_frames(waveform, mel_filters, window, num_frames, n_fft=400, hop_length=160, block_size=3000):
+    """
+    Computes the un-normalised log-mel frames of a whole 1d waveform on the host, `block_size` frames at a time to
+    bound the memory of the STFT buffers. Frame `t` is centered on sample `t * hop_length`: the start of the waveform
+    is reflect-padded and the waveform is zero-padded past its end, i.e. the same padding [`WhisperFeatureExtractor`]
+    applies to a 30s window. Slicing `nb_max_frames` frames starting at `start // hop_length` and normalising them with
+    [`normalize_log_mel`] gives the input features of the window starting at sample `start`.
+
+    Args:
+        waveform (`np.ndarray` of shape `(num_samples,)`):
+            The raw mono waveform.
+        mel_filters (`np.ndarray` of shape `(n_fft // 2 + 1, num_mel_bins)`):
+            The mel filterbank.
+        window (`np.ndarray` of shape `(n_fft,)`):
+            The STFT window.
+        num_frames (`int`):
+            The number of frames to compute. Frames past the end of the waveform only see zero-padding.
+        n_fft (`int`, *optional*, defaults to 400):
+            Size of the Fourier transform.
+        hop_length (`int`, *optional*, defaults to 160):
+            Number of samples between successive STFT frames.
+        block_size (`int`, *optional*, defaults to 3000):
+            The number of frames computed at once.
+
+    Returns:
+        `np.ndarray` of shape `(num_frames, num_mel_bins)`: the `log10` mel spectrogram, before normalisation.
+    """
+    pad = n_fft // 2
+    padded = np.zeros(max((num_frames - 1) * hop_length + n_fft, pad + waveform.shape[0] + 1), dtype=np.float64)
+    padded[pad : pad + waveform.shape[0]] = waveform
+    padded[:pad] = padded[pad + 1 : 2 * pad + 1][::-1]
+
+    window = np.asarray(window, dtype=np.float64)
+    log_mel = np.empty((num_frames, mel_filters.shape[-1]), dtype=np.float32)
+    for start in range(0, num_frames, block_size):
+        end = min(start + block_size, num_frames)
+        block = padded[start * hop_length : (end - 1) * hop_length + n_fft]
+        frames = np.lib.stride_tricks.sliding_window_view(block, n_fft)[::hop_length]
+        stft = np.fft.rfft(frames * window, axis=-1)
+        power_spec = stft.real**2 + stft.imag**2
+        log_mel[start:end] = np.log10(np.maximum(power_spec @ mel_filters, 1e-10))
+    return log_mel
+
+
+def normalize_log_mel(log_spec):
+    """Whisper's per-window normalisation of `log10` mel features: clamp to 8 below the window maximum and rescale."""
+    log_spec = np.maximum(log_spec, log_spec.max() - 8.0)
+    return (log_spec + 4.0) / 4.0
+
+
+class FlaxWhisperFeatureExtractor:
+    def __init__(
+        self,
+        feature_size=80,
+        sampling_rate=16000,
+        hop_length=160,
+        chunk_length=30,
+        n_fft=400,
+    ):
+        """
+        On-device equivalent of the `transformers` [`WhisperFeatureExtractor`]. Calling the feature extractor is a
+        pure JAX function of the raw waveforms, so it can be jitted together with
+        [`FlaxWhisperForConditionalGeneration.encode`] such that the host only needs to transfer PCM samples:
+
+        ```python
+        >>> feature_extractor = FlaxWhisperFeatureExtractor(feature_size=model.config.num_mel_bins)
+
+        >>> @jax.jit
+        ... def encode(params, waveforms):
+        ...     return model.encode(feature_extractor(waveforms), params=params)
+
+        >>> encoder_outputs = encode(params, feature_extractor.pad(raw_speech))
+        ```
+
+        Args
+            feature_size (`int`, *optional*, defaults to 80):
+                The number of mel bins, 80 for all Whisper checkpoints except large-v3 which uses 128.
+            sampling_rate (`int`, *optional*, defaults to 16000):
+                The sampling rate at which the audio files should be digitalized expressed in hertz (Hz).
+            hop_length (`int`, *optional*, defaults to 160):
+                Number of samples between successive STFT frames.
+            chunk_length (`int`, *optional*, defaults to 30):
+                The length in seconds of the audio windows the model operates on.
+            n_fft (`int`, *optional*, defaults to 400):
+                Size of the Fourier transform.
+        """
+        self.feature_size = feature_size
+        self.sampling_rate = sampling_rate
+        self.hop_length = hop_length
+        self.chunk_length = chunk_length
+        self.n_fft = n_fft
+        self.n_samples = chunk_length * sampling_rate
+        self.nb_max_frames = self.n_samples // hop_length
+
+        self.mel_filters = jnp.asarray(
+            mel_filter_bank(
+                num_frequency_bins=1 + n_fft // 2,
+                num_mel_filters=feature_size,
+                min_frequency=0.0,
+                max_frequency=8000.0,
+                sampling_rate=sampling_rate,
+                norm="slaney",
+                mel_scale="slaney",
+            ),
+            dtype=jnp.float32,
+        )
+        self.window = jnp.asarray(window_function(n_fft, "hann"), dtype=jnp.float32)
+
+    @classmethod
+    def from_feature_extractor(cls, feature_extractor):
+        """Builds the JAX feature extractor matching the config of a `transformers` [`WhisperFeatureExtractor`]."""
+        return cls(
+            feature_size=feature_extractor.feature_size,
+            sampling_rate=feature_extractor.sampling_rate,
+            hop_length=feature_extractor.hop_length,
+            chunk_length=feature_extractor.chunk_length,
+            n_fft=feature_extractor.n_fft,
+        )
+
+    def pad(self, raw_speech):
+        """
+        Zero-pads (or truncates) a list of 1d waveforms to `n_samples` on the host, returning a `np.ndarray` of shape
+        `(batch_size, n_samples)` ready to be transferred to the devices.
+        """
+        if isinstance(raw_speech, np.ndarray) and raw_speech.ndim == 1:
+            raw_speech = [raw_speech]
+
+        batch = np.zeros((len(raw_speech), self.n_samples), dtype=np.float32)
+        for i, waveform in enumerate(raw_speech):
+            waveform = np.asarray(waveform, dtype=np.float32)[: self.n_samples]
+            batch[i, : waveform.shape[0]] = waveform
+        return batch
+
+    def __call__(self, waveforms):
+        """
+        Args:
+            waveforms (`jnp.ndarray` of shape `(batch_size, num_samples)`):
+                The raw waveforms, typically padded to `n_samples` with [`~FlaxWhisperFeatureExtractor.pad`].
+
+        Returns:
+            `jnp.ndarray` of shape `(batch_size, feature_size, num_samples // hop_length)`: the log-mel input features.
+        """
+        return log_mel_spectrogram(
+            waveforms, self.mel_filters, self.window, n_fft=self.n_fft, hop_length=self.hop_length
+        )
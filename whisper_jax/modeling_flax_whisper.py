@@ -14,6 +14,7 @@
 # limitations under the License.
 """ Flax whisper model."""
 
+import copy
 import random
 from functools import partial
 from typing import Optional, Tuple
@@ -21,6 +22,7 @@ from typing import Optional, Tuple
 import flax.linen as nn
 import jax
 import jax.numpy as jnp
+from flax import struct
 from flax.core.frozen_dict import FrozenDict, freeze, unfreeze
 from flax.linen import combine_masks, make_causal_mask
 from flax.linen.attention import dot_product_attention_weights
@@ -33,6 +35,7 @@ from transformers.generation.flax_logits_process import (
     FlaxLogitsProcessorList,
     FlaxWhisperTimeStampLogitsProcessor,
 )
+from transformers.generation.flax_utils import FlaxGreedySearchOutput
 from transformers.modeling_flax_outputs import (
     FlaxBaseModelOutput,
     FlaxBaseModelOutputWithPastAndCrossAttentions,
@@ -204,7 +207,7 @@ class FlaxStaticForceTokensLogitsProcessor(FlaxLogitsProcessor):
         # Whisper is at position 3, so we only construct an array up to this index. The native version constructs a tensor
         # dynamically according to the length of the `force_token_map`. Array shapes need to be concrete for XLA compatibility,
         # so this is not permitted here.
-        force_token_array = jnp.ones(3, dtype=jnp.int32) * -1
+        force_token_array = jnp.ones(4, dtype=jnp.int32) * -1
         for index, token in force_token_map:
             force_token_array = force_token_array.at[index].set(token)
         self.force_token_array = jnp.int32(force_token_array)
@@ -235,6 +238,86 @@ class FlaxStaticForceTokensLogitsProcessor(FlaxLogitsProcessor):
         return scores
 
 
+class FlaxPerRowForceTokensLogitsProcessor(FlaxLogitsProcessor):
+    r"""
+    Per-row version of [`FlaxStaticForceTokensLogitsProcessor`]: every row of the batch forces its own tokens, such that
+    requests with different languages or tasks can share a batch (and a compiled executable).
+
+    Args:
+        force_token_array (`jnp.ndarray` of shape `(batch_size, num_forced_indices)`):
+            The token to force at each generation index for each row, with a negative value where no token is forced.
+    """
+
+    def __init__(self, force_token_array):
+        self.force_token_array = jnp.int32(force_token_array)
+
+    def __call__(self, input_ids: jnp.ndarray, scores: jnp.ndarray, cur_len: int) -> jnp.ndarray:
+        num_forced_indices = self.force_token_array.shape[1]
+        current_token = self.force_token_array[:, jnp.minimum(cur_len, num_forced_indices - 1)]
+        current_token = jnp.where(cur_len < num_forced_indices, current_token, -1)
+
+        # as in the static version, the forced token gets a log prob of 0 and all other tokens `-inf`
+        forced_scores = jnp.where(jnp.arange(scores.shape[-1]) == current_token[:, None], 0.0, -float("inf"))
+        return jnp.where(current_token[:, None] >= 0, forced_scores.astype(scores.dtype), scores)
+
+
+class FlaxPerRowTimeStampLogitsProcessor(FlaxWhisperTimeStampLogitsProcessor):
+    r"""
+    [`FlaxWhisperTimeStampLogitsProcessor`] that only applies to the rows of the batch that predict timestamps.
+
+    Args:
+        return_timestamps (`jnp.ndarray` of shape `(batch_size,)`):
+            Boolean mask of the rows that predict timestamps.
+
+        All other arguments are the same as for [`FlaxWhisperTimeStampLogitsProcessor`].
+    """
+
+    def __init__(self, generate_config, model_config, decoder_input_length, return_timestamps):
+        super().__init__(generate_config, model_config, decoder_input_length)
+        self.return_timestamps = return_timestamps
+
+    def __call__(self, input_ids, scores, cur_len):
+        timestamp_scores = super().__call__(input_ids, scores, cur_len)
+        return jnp.where(self.return_timestamps[:, None], timestamp_scores, scores)
+
+
+class FlaxPaddedRowsLogitsProcessor(FlaxLogitsProcessor):
+    r"""
+    [`FlaxLogitsProcessor`] that forces the EOS token on the rows of the batch that only hold padding, such that they
+    finish at the first generation step and never keep the generation loop running.
+
+    Args:
+        valid_rows (`jnp.ndarray` of shape `(batch_size,)`):
+            Boolean mask of the rows holding real inputs.
+        eos_token_id (`int`):
+            The id of the *end-of-sequence* token.
+    """
+
+    def __init__(self, valid_rows, eos_token_id):
+        self.valid_rows = valid_rows
+        self.eos_token_id = eos_token_id
+
+    def __call__(self, input_ids: jnp.ndarray, scores: jnp.ndarray, cur_len: int) -> jnp.ndarray:
+        eos_scores = jnp.full(scores.shape[-1:], -float("inf"), dtype=scores.dtype).at[self.eos_token_id].set(0)
+        return jnp.where(self.valid_rows[:, None], scores, eos_scores)
+
+
+@struct.dataclass
+class SlotDecodingState:
+    """Loop state of [`~FlaxWhisperForConditionalGeneration.slot_generate`]."""
+
+    sequences: jnp.ndarray
+    cur_len: jnp.ndarray
+    slot_chunk: jnp.ndarray
+    is_free: jnp.ndarray
+    next_chunk: jnp.ndarray
+    num_finished: jnp.ndarray
+    output_sequences: jnp.ndarray
+    cache: dict
+    encoded_block: jnp.ndarray
+    encoder_hidden_states: jnp.ndarray
+
+
 class FlaxWhisperAttention(nn.Module):
     config: WhisperConfig
     embed_dim: int
@@ -292,17 +375,24 @@ class FlaxWhisperAttention(nn.Module):
         batch_size = hidden_states.shape[0]
 
         query_states = self.q_proj(hidden_states)
+        query_states = self._split_heads(query_states)
 
-        if is_cross_attention:
-            key_states = self.k_proj(key_value_states)
-            value_states = self.v_proj(key_value_states)
+        if is_cross_attention and self.has_variable("cache", "cached_cross_key"):
+            # The cross-attention keys and values only depend on the encoder outputs, so they are projected once
+            # when the cache is initialised and re-used for every decoding step.
+            key_states = self.variables["cache"]["cached_cross_key"]
+            value_states = self.variables["cache"]["cached_cross_value"]
+        elif is_cross_attention:
+            key_states = self._split_heads(self.k_proj(key_value_states))
+            value_states = self._split_heads(self.v_proj(key_value_states))
+            # Only store the projections when the cache is built with the real params (i.e. through `apply`): during
+            # `init` the params are random, so the cached states would be meaningless.
+            if init_cache and not self.is_initializing():
+                self.put_variable("cache", "cached_cross_key", key_states)
+                self.put_variable("cache", "cached_cross_value", value_states)
         else:
-            key_states = self.k_proj(hidden_states)
-            value_states = self.v_proj(hidden_states)
-
-        query_states = self._split_heads(query_states)
-        key_states = self._split_heads(key_states)
-        value_states = self._split_heads(value_states)
+            key_states = self._split_heads(self.k_proj(hidden_states))
+            value_states = self._split_heads(self.v_proj(hidden_states))
 
         query_states = with_sharding_constraint(query_states, ("batch", "length", "heads", "kv"))
         key_states = with_sharding_constraint(key_states, ("batch", "length", "heads", "kv"))
@@ -314,11 +404,21 @@ class FlaxWhisperAttention(nn.Module):
                 mask_shift = self.variables["cache"]["cache_index"]
                 # max_length of cached_key is last dim
                 max_decoder_length = self.variables["cache"]["cached_key"].shape[-1]
-                causal_mask = lax.dynamic_slice(
-                    self.causal_mask,
-                    (0, 0, mask_shift, 0),
-                    (1, 1, query_length, max_decoder_length),
-                )
+                if mask_shift.ndim == 0:
+                    causal_mask = lax.dynamic_slice(
+                        self.causal_mask,
+                        (0, 0, mask_shift, 0),
+                        (1, 1, query_length, max_decoder_length),
+                    )
+                else:
+                    # per-row cache index (slot-based decoding): each row is at its own position in the sequence
+                    causal_mask = jax.vmap(
+                        lambda shift: lax.dynamic_slice(
+                            self.causal_mask,
+                            (0, 0, shift, 0),
+                            (1, 1, query_length, max_decoder_length),
+                        )[0]
+                    )(mask_shift)
             else:
                 causal_mask = self.causal_mask[:, :, :query_length, :key_length]
             causal_mask = jnp.broadcast_to(causal_mask, (batch_size,) + causal_mask.shape[1:])
@@ -428,6 +528,9 @@ class FlaxWhisperAttention(nn.Module):
                 value = cached_value.value + jnp.matmul(one_token_value, indices)
             else:
                 one_hot_indices = jax.nn.one_hot(cur_index, seq_length, dtype=key.dtype)
+                if cur_index.ndim == 1:
+                    # per-row cache index of shape [batch_size]: broadcast the one-hot over the heads and head dim
+                    one_hot_indices = one_hot_indices[:, None, None, :]
                 key = cached_key.value + one_token_key * one_hot_indices
                 value = cached_value.value + one_token_value * one_hot_indices
 
@@ -442,8 +545,9 @@ class FlaxWhisperAttention(nn.Module):
             # causal mask for cached decoder self-attention: our single query position should only
             # attend to those key positions that have already been generated and cached, not the
             # remaining zero elements.
+            pad_mask = jnp.arange(seq_length) < jnp.expand_dims(cur_index + num_updated_cache_vectors, -1)
             pad_mask = jnp.broadcast_to(
-                jnp.arange(seq_length) < cur_index + num_updated_cache_vectors,
+                pad_mask[..., None, None, :],
                 (batch_size,) + (1, num_updated_cache_vectors, seq_length),
             )
             attention_mask = combine_masks(pad_mask, attention_mask)
@@ -668,6 +772,7 @@ class FlaxWhisperDecoderLayer(nn.Module):
                 hidden_states=encoder_layer_norm_output,
                 key_value_states=encoder_hidden_states,
                 attention_mask=encoder_attention_mask,
+                init_cache=init_cache,
             )
             cross_attn_output = self.dropout_layer(cross_attn_output, deterministic=deterministic)
             cross_attn_output = residual + cross_attn_output
@@ -1043,7 +1148,7 @@ class FlaxWhisperPreTrainedModel(FlaxPreTrainedModel):
             return random_params
 
     # Copied from transformers.models.bart.modeling_flax_bart.FlaxBartPreTrainedModel.init_cache with Bart->Whisper
-    def init_cache(self, batch_size, max_length, encoder_outputs):
+    def init_cache(self, batch_size, max_length, encoder_outputs, params: dict = None):
         r"""
         Args:
             batch_size (`int`):
@@ -1056,6 +1161,10 @@ class FlaxWhisperPreTrainedModel(FlaxPreTrainedModel):
                 `attentions`). `last_hidden_state` of shape `(batch_size, sequence_length, hidden_size)`, *optional*)
                 is a sequence of hidden-states at the output of the last layer of the encoder. Used in the
                 cross-attention of the decoder.
+            params (`Dict[str, jnp.ndarray]`, *optional*):
+                Model parameters. If passed, the cross-attention keys and values are projected from `encoder_outputs`
+                once and stored in the cache as `cached_cross_key` / `cached_cross_value`, such that the decoder does
+                not re-compute them at every auto-regressive step.
         """
         # init input variables to retrieve cache
         decoder_input_ids = jnp.ones((batch_size, max_length), dtype="i4")
@@ -1073,15 +1182,29 @@ class FlaxWhisperPreTrainedModel(FlaxPreTrainedModel):
                 **kwargs,
             )
 
-        init_variables = self.module.init(
-            jax.random.PRNGKey(0),
-            decoder_input_ids=decoder_input_ids,
-            decoder_attention_mask=decoder_attention_mask,
-            decoder_position_ids=decoder_position_ids,
-            encoder_hidden_states=encoder_outputs[0],
-            init_cache=True,
-            method=_decoder_forward,  # we only need to call the decoder to init the cache
-        )
+        if params is None:
+            init_variables = self.module.init(
+                jax.random.PRNGKey(0),
+                decoder_input_ids=decoder_input_ids,
+                decoder_attention_mask=decoder_attention_mask,
+                decoder_position_ids=decoder_position_ids,
+                encoder_hidden_states=encoder_outputs[0],
+                init_cache=True,
+                method=_decoder_forward,  # we only need to call the decoder to init the cache
+            )
+        else:
+            # run the decoder with the real params, such that the cross-attention projections can be stored in the
+            # cache - all other decoder outputs are unused and get pruned by XLA
+            _, init_variables = self.module.apply(
+                {"params": params},
+                decoder_input_ids=decoder_input_ids,
+                decoder_attention_mask=decoder_attention_mask,
+                decoder_position_ids=decoder_position_ids,
+                encoder_hidden_states=encoder_outputs[0],
+                init_cache=True,
+                mutable=["cache"],
+                method=_decoder_forward,
+            )
         return unfreeze(init_variables["cache"])
 
     @add_start_docstrings(WHISPER_ENCODE_INPUTS_DOCSTRING)
@@ -1527,19 +1650,117 @@ class FlaxWhisperForConditionalGeneration(FlaxWhisperPreTrainedModel):
 
         return outputs
 
+    def detect_language(
+        self,
+        input_features=None,
+        encoder_outputs=None,
+        language_token_ids=None,
+        generation_config=None,
+        params: dict = None,
+    ):
+        r"""
+        Spoken language identification for a batch of segments. A single decoder step is run from the decoder start
+        token, and its final hidden state is projected onto the output embeddings of the language tokens only, rather
+        than onto the full vocabulary, so that the cost of the projection is independent of the vocabulary size.
+
+        Args:
+            input_features (`jnp.ndarray` of shape `(batch_size, feature_size, sequence_length)`, *optional*):
+                The log-mel features of the segments. Not needed if `encoder_outputs` are given.
+            encoder_outputs (`FlaxBaseModelOutput` or `jnp.ndarray`, *optional*):
+                Precomputed encoder outputs of the segments, e.g. the ones also used for generation.
+            language_token_ids (`List[int]` or `jnp.ndarray`, *optional*):
+                The ids of the candidate language tokens. Defaults to all the languages of
+                `generation_config.lang_to_id`, in increasing token id order.
+            generation_config (`GenerationConfig`, *optional*):
+                Defaults to the generation config of the model.
+            params (`Dict[str, jnp.ndarray]`, *optional*):
+                Model parameters, defaults to `self.params`.
+
+        Returns:
+            `jnp.ndarray` of shape `(batch_size, num_languages)`: the probability of each candidate language for each
+            segment, in the order of `language_token_ids`.
+        """
+        if input_features is None and encoder_outputs is None:
+            raise ValueError("You have to specify either `input_features` or `encoder_outputs`.")
+
+        if generation_config is None:
+            generation_config = self.generation_config
+        if language_token_ids is None:
+            if not hasattr(generation_config, "lang_to_id"):
+                raise ValueError(
+                    "The generation config has no `lang_to_id` mapping, so the candidate `language_token_ids` must "
+                    "be passed explicitly."
+                )
+            language_token_ids = sorted(generation_config.lang_to_id.values())
+        language_token_ids = jnp.asarray(language_token_ids, dtype="i4")
+
+        if encoder_outputs is None:
+            encoder_outputs = self.encode(input_features, params=params)
+        if isinstance(encoder_outputs, (tuple, FlaxBaseModelOutput)):
+            encoder_hidden_states = encoder_outputs[0]
+        else:
+            encoder_hidden_states = encoder_outputs
+
+        batch_size = encoder_hidden_states.shape[0]
+        decoder_input_ids = jnp.full((batch_size, 1), self.config.decoder_start_token_id, dtype="i4")
+
+        def _language_forward(module, decoder_input_ids, encoder_hidden_states):
+            decoder_module = module._get_decoder_module()
+            hidden_states = decoder_module(
+                input_ids=decoder_input_ids,
+                attention_mask=jnp.ones_like(decoder_input_ids),
+                position_ids=jnp.zeros_like(decoder_input_ids),
+                encoder_hidden_states=encoder_hidden_states,
+                deterministic=True,
+            )[0][:, -1]
+
+            # only gather the output embeddings of the language tokens, instead of materialising the full logits
+            if self.config.tie_word_embeddings:
+                language_embeddings = module.model.decoder.embed_tokens.variables["params"]["embedding"]
+                language_embeddings = jnp.take(language_embeddings, language_token_ids, axis=0)
+            else:
+                language_embeddings = module.lm_head.variables["params"]["kernel"]
+                language_embeddings = jnp.take(language_embeddings, language_token_ids, axis=1).T
+            language_embeddings = language_embeddings.astype(self.dtype)
+
+            return jnp.einsum("bd,ld->bl", hidden_states.astype(self.dtype), language_embeddings)
+
+        language_logits = self.module.apply(
+            {"params": params or self.params},
+            decoder_input_ids=decoder_input_ids,
+            encoder_hidden_states=encoder_hidden_states,
+            method=_language_forward,
+        )
+        return jax.nn.softmax(language_logits.astype(jnp.float32), axis=-1)
+
     def generate(
         self,
-        input_features,
+        input_features=None,
         generation_config=None,
         logits_processor=None,
         return_timestamps=None,
         task=None,
         language=None,
         is_multilingual=None,
+        encoder_outputs=None,
         **kwargs,
     ):
+        if input_features is None and encoder_outputs is None:
+            raise ValueError("You have to specify either `input_features` or `encoder_outputs`.")
+
+        if encoder_outputs is not None:
+            # the encoder was already run (e.g. for language detection), so its outputs are fed to the decoder as they
+            # are - the inputs are then only read for their batch size
+            if not isinstance(encoder_outputs, (tuple, FlaxBaseModelOutput)):
+                encoder_outputs = FlaxBaseModelOutput(last_hidden_state=encoder_outputs)
+            kwargs["encoder_outputs"] = encoder_outputs
+            if input_features is None:
+                input_features = encoder_outputs[0]
+
         if generation_config is None:
             generation_config = self.generation_config
+        # the settings below are specific to this call, so they must not leak into the default generation config
+        generation_config = copy.deepcopy(generation_config)
 
         if return_timestamps is not None:
             generation_config.return_timestamps = return_timestamps
@@ -1550,7 +1771,12 @@ class FlaxWhisperForConditionalGeneration(FlaxWhisperPreTrainedModel):
         if is_multilingual is not None:
             generation_config.is_multilingual = is_multilingual
 
-        if language is not None:
+        language_token_id = None
+        if language is not None and not isinstance(language, str):
+            # the language can also be passed as its (possibly traced) token id, such that a single compiled
+            # executable serves all languages, or as an array of token ids with one language per row
+            language_token_id = language
+        elif language is not None:
             generation_config.language = language
 
         if kwargs is not None and "decoder_input_ids" in kwargs:
@@ -1561,7 +1787,9 @@ class FlaxWhisperForConditionalGeneration(FlaxWhisperPreTrainedModel):
         forced_decoder_ids = []
 
         if hasattr(generation_config, "is_multilingual") and generation_config.is_multilingual:
-            if hasattr(generation_config, "language"):
+            if language_token_id is not None:
+                forced_decoder_ids.append((1, language_token_id))
+            elif hasattr(generation_config, "language"):
                 forced_decoder_ids.append((1, generation_config.lang_to_id[generation_config.language]))
             else:
                 forced_decoder_ids.append((1, None))
@@ -1582,9 +1810,22 @@ class FlaxWhisperForConditionalGeneration(FlaxWhisperPreTrainedModel):
                 idx = forced_decoder_ids[-1][0] + 1 if forced_decoder_ids else 1
                 forced_decoder_ids.append((idx, generation_config.no_timestamps_token_id))
 
-        if len(forced_decoder_ids) > 0:
+        if language_token_id is not None and jnp.ndim(language_token_id) > 0:
+            # the forced tokens differ between rows, so they are applied by the per-row processor (after the default
+            # processors, as in `pipeline_generate`) rather than through the generation config
+            force_token_array = jnp.full(
+                (jnp.shape(language_token_id)[0], forced_decoder_ids[-1][0] + 1), -1, dtype=jnp.int32
+            )
+            for index, token in forced_decoder_ids:
+                force_token_array = force_token_array.at[:, index].set(token)
+            logits_processor = [FlaxPerRowForceTokensLogitsProcessor(force_token_array)] + list(logits_processor or [])
+            generation_config.forced_decoder_ids = None
+        elif len(forced_decoder_ids) > 0:
             generation_config.forced_decoder_ids = forced_decoder_ids
 
+        # forward the params to `prepare_inputs_for_generation` to pre-compute the cross-attention cache
+        kwargs["decoder_params"] = kwargs.get("params")
+
         return super().generate(
             input_features,
             generation_config,
@@ -1598,6 +1839,7 @@ class FlaxWhisperForConditionalGeneration(FlaxWhisperPreTrainedModel):
         forced_decoder_ids,
         return_timestamps=False,
         generation_config=None,
+        valid_rows=None,
         **kwargs,
     ):
         if generation_config is None:
@@ -1608,11 +1850,27 @@ class FlaxWhisperForConditionalGeneration(FlaxWhisperPreTrainedModel):
 
         logits_processor = FlaxLogitsProcessorList()
 
-        logits_processor.append(FlaxStaticForceTokensLogitsProcessor(forced_decoder_ids))
+        # the forced decoder ids and timestamp mode are either shared by the whole batch (list of `(index, token)`
+        # pairs and bool), or given per row as arrays, such that requests with different settings can share a batch
+        if isinstance(forced_decoder_ids, (list, tuple)):
+            logits_processor.append(FlaxStaticForceTokensLogitsProcessor(forced_decoder_ids))
+        else:
+            logits_processor.append(FlaxPerRowForceTokensLogitsProcessor(forced_decoder_ids))
 
-        if hasattr(generation_config, "return_timestamps") and return_timestamps:
+        if hasattr(generation_config, "return_timestamps") and jnp.ndim(return_timestamps) > 0:
+            logits_processor.append(
+                FlaxPerRowTimeStampLogitsProcessor(generation_config, self.config, 1, return_timestamps)
+            )
+        elif hasattr(generation_config, "return_timestamps") and return_timestamps:
             logits_processor.append(FlaxWhisperTimeStampLogitsProcessor(generation_config, self.config, 1))
 
+        if valid_rows is not None:
+            # applied last, such that the padded rows emit EOS whatever the other processors force
+            logits_processor.append(FlaxPaddedRowsLogitsProcessor(valid_rows, generation_config.eos_token_id))
+
+        # forward the params to `prepare_inputs_for_generation` to pre-compute the cross-attention cache
+        kwargs["decoder_params"] = kwargs.get("params")
+
         return super().generate(
             input_features,
             generation_config,
@@ -1620,6 +1878,206 @@ class FlaxWhisperForConditionalGeneration(FlaxWhisperPreTrainedModel):
             **kwargs,
         )
 
+    def slot_generate(
+        self,
+        input_features,
+        forced_decoder_ids,
+        num_slots,
+        return_timestamps=False,
+        generation_config=None,
+        max_length=None,
+        params: dict = None,
+    ):
+        r"""
+        Greedy decoding of a queue of 30s chunks with in-flight batching. The decoder runs on a fixed number of cache
+        slots: as soon as the sequence in a slot finishes (EOS or `max_length`), it is written to the outputs and the
+        slot is refilled with the next chunk of the queue in the same decoding loop, rather than idling until the
+        longest sequence of the batch is done. Each slot keeps its own cache index and position, so all shapes stay
+        static and the whole queue is decoded by a single compiled `lax.while_loop`.
+
+        The chunks are encoded lazily, `num_slots` at a time: when a refill reaches a chunk past the current block,
+        the next block of `num_slots` chunks is encoded. Only the encoder outputs of one block are kept, so the memory
+        is bounded by the number of slots rather than by the length of the queue. Refilling a slot builds the cache of
+        the new chunk with [`~FlaxWhisperPreTrainedModel.init_cache`] (zeroed self-attention keys/values and the
+        cross-attention projections of its encoder outputs) and writes it into the row of the slot. The outputs are
+        identical to those of [`~FlaxWhisperForConditionalGeneration.pipeline_generate`] for the same chunks.
+
+        This is a standalone API: [`FlaxWhisperPipline`] and [`~FlaxWhisperForConditionalGeneration.pipeline_generate`]
+        decode fixed batches and do not use it. Jit it over a queue of chunks on a single device, e.g.:
+
+        ```python
+        >>> slot_generate = jax.jit(
+        ...     lambda params, input_features: model.slot_generate(
+        ...         input_features, forced_decoder_ids, num_slots=16, params=params
+        ...     ).sequences
+        ... )
+        >>> pred_ids = slot_generate(params, input_features)
+        ```
+
+        Args:
+            input_features (`jnp.ndarray` of shape `(num_chunks, feature_size, sequence_length)`):
+                The log-mel features of the queue of chunks.
+            forced_decoder_ids (`list`):
+                The forced decoder ids, as returned by `FlaxWhisperPipline.get_forced_decoder_ids`.
+            num_slots (`int`):
+                The number of sequences decoded in parallel, i.e. the batch size of the decoder.
+            return_timestamps (`bool`, *optional*, defaults to `False`):
+                Whether to predict timestamp tokens.
+            generation_config (`GenerationConfig`, *optional*):
+                Defaults to the generation config of the model.
+            max_length (`int`, *optional*):
+                The maximum length of the generated sequences. Defaults to `generation_config.max_length`.
+            params (`Dict[str, jnp.ndarray]`, *optional*):
+                Model parameters, defaults to `self.params`.
+
+        Returns:
+            [`~generation.FlaxGreedySearchOutput`] with `sequences` of shape `(num_chunks, max_length)`.
+        """
+        if generation_config is None:
+            generation_config = self.generation_config
+        # the settings below are specific to this call, so they must not leak into the default generation config
+        generation_config = copy.deepcopy(generation_config)
+        if params is None:
+            params = self.params
+        max_length = max_length if max_length is not None else generation_config.max_length
+
+        # as in `pipeline_generate`, the forced decoder ids are applied by the static logits processor
+        generation_config.forced_decoder_ids = None
+
+        logits_processor = FlaxLogitsProcessorList()
+        logits_processor.append(FlaxStaticForceTokensLogitsProcessor(forced_decoder_ids))
+        if hasattr(generation_config, "return_timestamps") and return_timestamps:
+            logits_processor.append(FlaxWhisperTimeStampLogitsProcessor(generation_config, self.config, 1))
+        logits_processor = self._get_logits_processor(generation_config, 1, logits_processor)
+
+        # the logits processors expect a single `cur_len` for the whole batch - map them over the slots instead
+        def process_logits(sequence, logits, cur_len):
+            return logits_processor(sequence[None], logits[None], cur_len)[0]
+
+        process_logits = jax.vmap(process_logits)
+
+        pad_token_id = jnp.array(generation_config.pad_token_id, dtype=jnp.int32)
+        eos_token_id = jnp.array(generation_config.eos_token_id, dtype=jnp.int32)
+        initial_sequence = jnp.full((max_length,), pad_token_id, dtype=jnp.int32)
+        initial_sequence = initial_sequence.at[0].set(generation_config.decoder_start_token_id)
+
+        # the queue is padded to a whole number of blocks of `num_slots` chunks, which are encoded one at a time
+        num_chunks = input_features.shape[0]
+        num_blocks = -(-num_chunks // num_slots)
+        input_features = jnp.pad(input_features, ((0, num_blocks * num_slots - num_chunks), (0, 0), (0, 0)))
+
+        def encode_block(block):
+            block_features = lax.dynamic_slice_in_dim(input_features, block * num_slots, num_slots)
+            return self.encode(block_features, params=params).last_hidden_state
+
+        block_shape = jax.eval_shape(encode_block, 0)
+
+        def init_slot_cache(block_hidden_states, chunk):
+            encoder_outputs = (lax.dynamic_slice_in_dim(block_hidden_states, chunk % num_slots, 1),)
+            return self.init_cache(1, max_length, encoder_outputs, params=params)
+
+        # same layout as the cache of `init_cache`, but with one cache index per slot
+        cache_shapes = jax.eval_shape(
+            lambda: self.init_cache(
+                num_slots,
+                max_length,
+                (jnp.zeros(block_shape.shape, block_shape.dtype),),
+                params=params,
+            )
+        )
+        cache = jax.tree_util.tree_map_with_path(
+            lambda path, x: jnp.zeros((num_slots,) if path[-1].key == "cache_index" else x.shape, x.dtype),
+            cache_shapes,
+        )
+
+        def write_slot_cache(cache, slot_cache, slot):
+            def update(path, x, y):
+                if path[-1].key == "cache_index":
+                    return x.at[slot].set(0)
+                return lax.dynamic_update_slice_in_dim(x, y.astype(x.dtype), slot, axis=0)
+
+            return jax.tree_util.tree_map_with_path(update, cache, slot_cache)
+
+        # the cross-attention keys/values are read from the cache, so the encoder outputs passed to the decoder are
+        # only a placeholder that enables the cross-attention layers
+        encoder_outputs = (jnp.zeros((num_slots, 1, block_shape.shape[-1]), block_shape.dtype),)
+        decoder_attention_mask = jnp.ones((num_slots, max_length), dtype="i4")
+        slots = jnp.arange(num_slots)
+
+        def refill_cond_fn(state):
+            return jnp.any(state.is_free) & (state.next_chunk < num_chunks)
+
+        def refill_body_fn(state):
+            slot = jnp.argmax(state.is_free)
+            # the chunks are assigned in order, so each block is encoded once, when its first chunk is reached
+            block = state.next_chunk // num_slots
+            block_hidden_states = lax.cond(
+                block == state.encoded_block,
+                lambda: state.encoder_hidden_states,
+                lambda: encode_block(block),
+            )
+            return state.replace(
+                sequences=state.sequences.at[slot].set(initial_sequence),
+                cur_len=state.cur_len.at[slot].set(1),
+                slot_chunk=state.slot_chunk.at[slot].set(state.next_chunk),
+                is_free=state.is_free.at[slot].set(False),
+                next_chunk=state.next_chunk + 1,
+                cache=write_slot_cache(state.cache, init_slot_cache(block_hidden_states, state.next_chunk), slot),
+                encoded_block=block,
+                encoder_hidden_states=block_hidden_states,
+            )
+
+        def decode_cond_fn(state):
+            return state.num_finished < num_chunks
+
+        def decode_body_fn(state):
+            state = lax.while_loop(refill_cond_fn, refill_body_fn, state)
+            is_active = ~state.is_free
+
+            running_token = jnp.take_along_axis(state.sequences, state.cur_len[:, None] - 1, axis=1)
+            model_outputs = self.decode(
+                running_token,
+                encoder_outputs,
+                decoder_attention_mask=decoder_attention_mask,
+                decoder_position_ids=state.cur_len[:, None] - 1,
+                past_key_values=state.cache,
+                params=params,
+            )
+            logits = process_logits(state.sequences, model_outputs.logits[:, -1], state.cur_len)
+            next_token = jnp.argmax(logits, axis=-1)
+
+            # slots without a chunk left to decode are run along with the others, but their outputs are dropped
+            sequences = state.sequences.at[slots, jnp.where(is_active, state.cur_len, max_length)].set(
+                next_token, mode="drop"
+            )
+            is_done = is_active & ((next_token == eos_token_id) | (state.cur_len + 1 == max_length))
+            output_sequences = state.output_sequences.at[jnp.where(is_done, state.slot_chunk, num_chunks)].set(
+                sequences, mode="drop"
+            )
+            return state.replace(
+                sequences=sequences,
+                cur_len=state.cur_len + is_active,
+                is_free=state.is_free | is_done,
+                num_finished=state.num_finished + is_done.sum(),
+                output_sequences=output_sequences,
+                cache=model_outputs.past_key_values,
+            )
+
+        state = SlotDecodingState(
+            sequences=jnp.broadcast_to(initial_sequence, (num_slots, max_length)),
+            cur_len=jnp.ones((num_slots,), dtype=jnp.int32),
+            slot_chunk=jnp.full((num_slots,), num_chunks, dtype=jnp.int32),
+            is_free=jnp.ones((num_slots,), dtype=jnp.bool_),
+            next_chunk=jnp.array(0, dtype=jnp.int32),
+            num_finished=jnp.array(0, dtype=jnp.int32),
+            output_sequences=jnp.full((num_chunks, max_length), pad_token_id, dtype=jnp.int32),
+            cache=cache,
+            encoded_block=jnp.array(-1, dtype=jnp.int32),
+            encoder_hidden_states=jnp.zeros(block_shape.shape, block_shape.dtype),
+        )
+        state = lax.while_loop(decode_cond_fn, decode_body_fn, state)
+        return FlaxGreedySearchOutput(sequences=state.output_sequences)
+
     def prepare_inputs_for_generation(
         self,
         decoder_input_ids,
@@ -1627,12 +2085,17 @@ class FlaxWhisperForConditionalGeneration(FlaxWhisperPreTrainedModel):
         attention_mask: Optional[jax.Array] = None,
         decoder_attention_mask: Optional[jax.Array] = None,
         encoder_outputs=None,
+        decoder_params: dict = None,
         **kwargs,
     ):
         # initializing the cache
         batch_size, seq_length = decoder_input_ids.shape
 
-        past_key_values = self.init_cache(batch_size, max_length, encoder_outputs)
+        if decoder_params is None and self._is_initialized:
+            decoder_params = self.params
+
+        # the cross-attention keys/values are computed once here from the encoder outputs and kept in the cache
+        past_key_values = self.init_cache(batch_size, max_length, encoder_outputs, params=decoder_params)
         # Note that usually one would have to put 0's in the attention_mask for x > input_ids.shape[-1] and x < cache_length.
         # But since the decoder uses a causal mask, those positions are masked anyways.
         # Thus we can create a single static attention_mask here, which is more efficient for compilation
@@ -15,6 +15,8 @@
 
 
 import math
+import queue
+import threading
 
 import jax
 import jax.numpy as jnp
@@ -23,12 +25,15 @@ import requests
 from flax import jax_utils
 from flax.core.frozen_dict import freeze
 from flax.training.common_utils import shard
+from jax.sharding import Mesh, NamedSharding
 from jax.sharding import PartitionSpec as P
 from transformers import WhisperProcessor, is_tokenizers_available, WhisperFeatureExtractor, WhisperTokenizerFast
+from transformers.audio_utils import window_function
 from transformers.models.whisper.tokenization_whisper import TO_LANGUAGE_CODE, WhisperTokenizer
 from transformers.pipelines.audio_utils import ffmpeg_read
 from transformers.utils import logging
 
+from .feature_extraction import normalize_log_mel, np_log_mel_frames
 from .modeling_flax_whisper import FlaxWhisperForConditionalGeneration
 from .partitioner import PjitPartitioner
 from .train_state import InferenceState
@@ -59,6 +64,7 @@ class FlaxWhisperPipline:
         dtype=jnp.float32,
         batch_size=None,
         max_length=None,
+        batch_buckets=None,
     ):
         """
         Args
@@ -75,6 +81,13 @@ class FlaxWhisperPipline:
                 a batch size in the `__init__` method will be superseded by any batch size passed to the `__call__` method.
             max_length (`int`, *optional*):
                 The maximum numbers of tokens to generate. Defaults to `model.config.max_length`.
+            batch_buckets (`List[int]`, *optional*):
+                Smaller batch sizes to use for partially filled batches, e.g. `[4, 8, 16]` with a batch size of 32. A
+                batch with fewer chunks than the batch size is only padded up to the smallest bucket that fits it,
+                rather than to the full batch size, such that short inputs do not pay for the compute of a full
+                batch. Each bucket size must be a multiple of the number of JAX devices. Every bucket compiles its own
+                executable: call [`~FlaxWhisperPipline.warmup`] at start-up to compile them ahead of the first
+                requests. Defaults to `None`, meaning that all batches are padded to the batch size.
         """
         self.checkpoint = checkpoint
         self.dtype = dtype
@@ -97,20 +110,33 @@ class FlaxWhisperPipline:
             batch_size if batch_size is not None else self.min_batch_size
         )  # we need a minimum of 1 batch per-device
 
-        def generate(params, input_features, forced_decoder_ids, return_timestamps):
+        if batch_buckets is not None:
+            for bucket in batch_buckets:
+                if bucket % self.min_batch_size != 0:
+                    raise ValueError(
+                        f"Batch buckets must be multiples of the number of JAX devices, but got bucket {bucket} and num devices {self.min_batch_size}."
+                    )
+            batch_buckets = sorted(set(batch_buckets))
+        self.batch_buckets = batch_buckets
+
+        def generate(params, input_features, valid_rows, force_token_array, return_timestamps):
             output_ids = self.model.pipeline_generate(
                 input_features,
                 params=params,
-                forced_decoder_ids=forced_decoder_ids,
+                forced_decoder_ids=force_token_array,
                 return_timestamps=return_timestamps,
+                valid_rows=valid_rows,
                 max_length=self.max_length,
             )
             return output_ids
 
         # use pmap for DP by default - this is compatible on a Colab TPU v2
         self.params = jax_utils.replicate(self.params)
-        self.p_generate = jax.pmap(
-            generate, "input_features", in_axes=(0, 0, None), out_axes=0, static_broadcasted_argnums=(3,)
+        # the forced tokens and timestamp mode are per-row inputs, so a single executable serves all languages / tasks
+        self.p_generate = jax.pmap(generate, "input_features", in_axes=(0, 0, 0, 0, 0), out_axes=0)
+        # sharding used to transfer prefetched batches to the local devices (one shard per device for pmap)
+        self.data_sharding = NamedSharding(
+            Mesh(np.array(jax.local_devices()), ("input_features",)), P("input_features")
         )
         self.is_sharded = False
 
@@ -161,14 +187,16 @@ class FlaxWhisperPipline:
 
         # This will auto-magically run in mesh context
         self.params = p_shard_params(freeze(jax_utils.unreplicate(self.params)))
+        self.data_sharding = NamedSharding(partitioner.mesh, P("data"))
         self.is_sharded = True
 
-        def generate(params, input_features, forced_decoder_ids, return_timestamps):
+        def generate(params, input_features, valid_rows, force_token_array, return_timestamps):
             output_ids = self.model.pipeline_generate(
                 input_features,
                 params=params,
-                forced_decoder_ids=forced_decoder_ids,
+                forced_decoder_ids=force_token_array,
                 return_timestamps=return_timestamps,
+                valid_rows=valid_rows,
                 max_length=self.max_length,
             )
             return output_ids
@@ -176,28 +204,100 @@ class FlaxWhisperPipline:
         # Use pjit for generate only once we've sharded the params
         self.p_generate = partitioner.partition(
             generate,
-            in_axis_resources=(params_spec, P("data"), None),
+            in_axis_resources=(params_spec, P("data"), P("data"), P("data"), P("data")),
             out_axis_resources=P("data"),
-            static_argnums=(3,),
         )
 
-    def generate(self, input_features, language=None, task=None, return_timestamps=False):
-        forced_decoder_ids = self.get_forced_decoder_ids(
-            language=language, task=task, return_timestamps=return_timestamps
+    def generate(self, input_features, language=None, task=None, return_timestamps=False, valid_rows=None):
+        """
+        Generates the token ids of a batch of input features. `language`, `task` and `return_timestamps` are either
+        shared by the whole batch, or lists with one value per row, such that requests with different settings can
+        share a batch. Rows past the end of the lists are treated as padding.
+        """
+        batch_size = input_features.shape[0]
+        force_token_array, return_timestamps = self.get_decoding_inputs(
+            batch_size, language=language, task=task, return_timestamps=return_timestamps
         )
+        if valid_rows is None:
+            valid_rows = np.ones(batch_size, dtype=bool)
         if not self.is_sharded:
             # if we're using pmap we need to manually replicate the input data across devices and gather the output tokens
             output_ids = self.p_generate(
-                freeze(self.params), shard(input_features), forced_decoder_ids, return_timestamps
+                freeze(self.params),
+                shard(input_features),
+                shard(valid_rows),
+                shard(force_token_array),
+                shard(return_timestamps),
             ).sequences
             output_ids = jax.device_get(output_ids.reshape(-1, self.max_length))
         else:
             # pjit handles replication / gathering for us auto-magically
             output_ids = self.p_generate(
-                freeze(self.params), input_features, forced_decoder_ids, return_timestamps
+                freeze(self.params), input_features, valid_rows, force_token_array, return_timestamps
             ).sequences
         return output_ids
 
+    def warmup(self, batch_size=None):
+        """
+        Compiles the generation for the batch size and each of the batch buckets smaller than it, by running it once on
+        padding inputs. The compiled executables are cached by JAX, so subsequent batches of any of these sizes run
+        without compilation, whatever their language, task and timestamp settings. When using
+        [`~FlaxWhisperPipline.shard_params`], call this method after sharding the params.
+        """
+        batch_size = batch_size if batch_size is not None else self.batch_size
+        input_shape = (self.model.config.num_mel_bins, 2 * self.model.config.max_source_positions)
+        for bucket_size in self.get_batch_buckets(batch_size):
+            input_features = np.zeros((bucket_size, *input_shape), dtype=np.float32)
+            # marking all rows as padding compiles the whole generation loop, but exits it after the first step
+            valid_rows = np.zeros(bucket_size, dtype=bool)
+            self.generate(input_features, valid_rows=valid_rows)
+
+    def get_batch_buckets(self, batch_size):
+        # the sizes a batch can be padded to, in increasing order: the buckets below the batch size, then the batch size
+        if self.batch_buckets is None:
+            return [batch_size]
+        return [bucket for bucket in self.batch_buckets if bucket < batch_size] + [batch_size]
+
+    def get_padded_batch_size(self, input_batch_size, batch_size):
+        # pad to the smallest bucket that fits the batch
+        for bucket_size in self.get_batch_buckets(batch_size):
+            if input_batch_size <= bucket_size:
+                return bucket_size
+        return batch_size
+
+    def get_decoding_inputs(self, batch_size, language=None, task=None, return_timestamps=False):
+        """
+        Builds the per-row inputs of `p_generate`: the forced tokens of each row as an `np.ndarray` of shape
+        `(batch_size, 4)` (see [`~FlaxWhisperPipline.get_force_token_array`]) and the timestamp mode of each row.
+        `language`, `task` and `return_timestamps` are either shared by all rows or lists with one value per row.
+        """
+
+        def per_row(value, default):
+            values = list(value) if isinstance(value, (list, tuple)) else [value] * batch_size
+            return values + [default] * (batch_size - len(values))
+
+        languages = per_row(language, None)
+        tasks = per_row(task, None)
+        return_timestamps = per_row(return_timestamps, False)
+
+        force_token_array = np.stack(
+            [
+                self.get_force_token_array(language=row_language, task=row_task, return_timestamps=row_timestamps)
+                for row_language, row_task, row_timestamps in zip(languages, tasks, return_timestamps)
+            ]
+        )
+        return force_token_array, np.array([bool(row_timestamps) for row_timestamps in return_timestamps])
+
+    def get_force_token_array(self, generation_config=None, task=None, language=None, return_timestamps=False):
+        # the forced decoder ids indexed by generation step (0 to 3: start of transcript, language, task and no
+        # timestamps), with -1 at the steps where no token is forced
+        force_token_array = np.full(4, -1, dtype=np.int32)
+        for index, token in self.get_forced_decoder_ids(
+            generation_config=generation_config, task=task, language=language, return_timestamps=return_timestamps
+        ):
+            force_token_array[index] = token
+        return force_token_array
+
     def get_forced_decoder_ids(self, generation_config=None, task=None, language=None, return_timestamps=False):
         if generation_config is None:
             generation_config = self.model.generation_config
@@ -245,7 +345,9 @@ class FlaxWhisperPipline:
 
         return forced_decoder_ids
 
-    def chunk_iter_with_batch(self, inputs, chunk_len, stride_left, stride_right, batch_size):
+    def chunk_iter_with_batch(
+        self, inputs, chunk_len, stride_left, stride_right, batch_size, whole_file_log_mel=False
+    ):
         inputs_len = inputs.shape[0]
         step = chunk_len - stride_left - stride_right
 
@@ -255,14 +357,42 @@ class FlaxWhisperPipline:
         num_batches = math.ceil(num_samples / batch_size)
         batch_idx = np.array_split(np.arange(num_samples), num_batches)
 
+        hop_length = self.feature_extractor.hop_length
+        nb_max_frames = self.feature_extractor.nb_max_frames
+        if whole_file_log_mel and (chunk_len != self.feature_extractor.n_samples or step % hop_length != 0):
+            logger.warning(
+                "Whole-file log-mel computation requires chunks of exactly "
+                f"{self.feature_extractor.chunk_length}s spaced by a multiple of the hop length ({hop_length} samples), "
+                "falling back to computing the log-mel of each chunk separately."
+            )
+            whole_file_log_mel = False
+
+        if whole_file_log_mel:
+            # compute the STFT of the overlapping chunks once: the features of each chunk are a slice of the frames
+            log_mel = np_log_mel_frames(
+                inputs,
+                self.feature_extractor.mel_filters,
+                window_function(self.feature_extractor.n_fft, "hann"),
+                num_frames=all_chunk_start_idx[-1] // hop_length + nb_max_frames,
+                n_fft=self.feature_extractor.n_fft,
+                hop_length=hop_length,
+            )
+
         for idx in batch_idx:
             chunk_start_idx = all_chunk_start_idx[idx]
             chunk_end_idx = chunk_start_idx + chunk_len
 
             chunks = [inputs[chunk_start:chunk_end] for chunk_start, chunk_end in zip(chunk_start_idx, chunk_end_idx)]
-            processed = self.feature_extractor(
-                chunks, sampling_rate=self.feature_extractor.sampling_rate, return_tensors="np"
-            )
+            if whole_file_log_mel:
+                input_features = np.empty((len(chunks), *log_mel.shape[1:][::-1], nb_max_frames), dtype=np.float32)
+                for i, chunk_start in enumerate(chunk_start_idx):
+                    start_frame = chunk_start // hop_length
+                    input_features[i] = normalize_log_mel(log_mel[start_frame : start_frame + nb_max_frames]).T
+                processed = {"input_features": input_features}
+            else:
+                processed = self.feature_extractor(
+                    chunks, sampling_rate=self.feature_extractor.sampling_rate, return_tensors="np"
+                )
 
             _stride_left = np.where(chunk_start_idx == 0, 0, stride_left)
             is_last = np.where(stride_right > 0, chunk_end_idx > inputs_len, chunk_end_idx >= inputs_len)
@@ -276,7 +406,9 @@ class FlaxWhisperPipline:
 
             yield {"stride": strides, **processed}
 
-    def preprocess_batch(self, inputs, chunk_length_s=30.0, stride_length_s=None, batch_size=None):
+    def preprocess_batch(
+        self, inputs, chunk_length_s=30.0, stride_length_s=None, batch_size=None, whole_file_log_mel=False
+    ):
         if isinstance(inputs, np.ndarray):
             logger.warning(
                 "Numpy array passed as input - no sampling rate checks will be performed."
@@ -363,6 +495,7 @@ class FlaxWhisperPipline:
                 stride_left,
                 stride_right,
                 batch_size,
+                whole_file_log_mel=whole_file_log_mel,
             ):
                 yield item
         else:
@@ -401,14 +534,25 @@ class FlaxWhisperPipline:
         # We need to keep track of some additional input arguments for post-processing so need to forward these on after running generation
         input_features = model_inputs.pop("input_features")
         input_batch_size = input_features.shape[0]
-
-        if input_batch_size != batch_size:
-            padding = np.zeros([batch_size - input_batch_size, *input_features.shape[1:]], input_features.dtype)
+        # batches packed from several inputs carry their per-row generation settings
+        language = model_inputs.pop("language", language)
+        task = model_inputs.pop("task", task)
+        return_timestamps = model_inputs.pop("return_timestamps", return_timestamps)
+
+        padded_batch_size = self.get_padded_batch_size(input_batch_size, batch_size)
+        if input_batch_size != padded_batch_size:
+            padding = np.zeros([padded_batch_size - input_batch_size, *input_features.shape[1:]], input_features.dtype)
             input_features = np.concatenate([input_features, padding])
+        # the padded rows are flagged such that they finish at the first step instead of being decoded
+        valid_rows = np.arange(padded_batch_size) < input_batch_size
 
-        pred_ids = self.generate(input_features, language=language, task=task, return_timestamps=return_timestamps)[
-            :input_batch_size
-        ]
+        pred_ids = self.generate(
+            input_features,
+            language=language,
+            task=task,
+            return_timestamps=return_timestamps,
+            valid_rows=valid_rows,
+        )[:input_batch_size]
 
         # tokenizer's decode method expects an extra dim - we insert it here for convenience
         out = {"tokens": pred_ids[:, None, :]}
@@ -419,6 +563,121 @@ class FlaxWhisperPipline:
 
         return out
 
+    def _device_put(self, inputs):
+        # transfer the (padded) batch inputs to the devices in the layout expected by `p_generate`
+        if not self.is_sharded:
+            inputs = shard(inputs)
+        return jax.device_put(inputs, self.data_sharding)
+
+    def _prefetch(self, dataloader, batch_size, prefetch_size, language=None, task=None, return_timestamps=False):
+        """
+        Runs the feature extraction, padding and host-to-device transfer of the batches yielded by `dataloader` in a
+        background thread, keeping up to `prefetch_size` batches ready on device ahead of the one being generated.
+        The worker stops as soon as the returned generator is closed, e.g. because the consumer raised.
+        """
+        batches = queue.Queue(maxsize=prefetch_size)
+        sentinel = object()
+        stop = threading.Event()
+
+        def put(item):
+            # never block on a full queue once the consumer is gone
+            while not stop.is_set():
+                try:
+                    batches.put(item, timeout=0.1)
+                    return True
+                except queue.Full:
+                    pass
+            return False
+
+        def worker():
+            try:
+                for batch in dataloader:
+                    if stop.is_set():
+                        return
+                    input_features = batch.pop("input_features")
+                    batch["input_batch_size"] = input_batch_size = input_features.shape[0]
+                    padded_batch_size = self.get_padded_batch_size(input_batch_size, batch_size)
+                    if input_batch_size != padded_batch_size:
+                        padding = np.zeros(
+                            [padded_batch_size - input_batch_size, *input_features.shape[1:]], input_features.dtype
+                        )
+                        input_features = np.concatenate([input_features, padding])
+                    batch["input_features"] = self._device_put(input_features)
+                    batch["valid_rows"] = self._device_put(np.arange(padded_batch_size) < input_batch_size)
+                    force_token_array, timestamp_rows = self.get_decoding_inputs(
+                        padded_batch_size,
+                        language=batch.pop("language", language),
+                        task=batch.pop("task", task),
+                        return_timestamps=batch.pop("return_timestamps", return_timestamps),
+                    )
+                    batch["force_token_array"] = self._device_put(force_token_array)
+                    batch["timestamp_rows"] = self._device_put(timestamp_rows)
+                    if not put(batch):
+                        return
+            except Exception as err:
+                # re-raised in the main thread
+                put(err)
+            finally:
+                put(sentinel)
+
+        thread = threading.Thread(target=worker, daemon=True)
+        thread.start()
+        try:
+            while True:
+                batch = batches.get()
+                if batch is sentinel:
+                    return
+                if isinstance(batch, Exception):
+                    raise batch
+                yield batch
+        finally:
+            stop.set()
+            thread.join()
+
+    def _prefetch_forward(
+        self, dataloader, batch_size, prefetch_size, language=None, task=None, return_timestamps=False
+    ):
+        """
+        Generates the batches prepared by [`~FlaxWhisperPipline._prefetch`], gathering the tokens of batch N-1 while
+        batch N runs on device. Only the device-to-host copy of the tokens is overlapped: the detokenization stays in
+        [`~FlaxWhisperPipline.postprocess`], since `_decode_asr` merges the strided chunks of an input on token ids and
+        so needs the tokens of all its batches at once.
+        """
+
+        def fetch(batch, output_ids):
+            # blocks until the generation of `batch` has finished on device
+            output_ids = jax.device_get(output_ids.reshape(-1, self.max_length))
+            out = {"tokens": output_ids[: batch["input_batch_size"], None, :]}
+            if batch.get("stride") is not None:
+                out["stride"] = batch["stride"]
+            return out
+
+        model_outputs = []
+        pending = None
+        batches = self._prefetch(
+            dataloader, batch_size, prefetch_size, language=language, task=task, return_timestamps=return_timestamps
+        )
+        try:
+            for batch in batches:
+                # dispatch batch N asynchronously, then gather the tokens of batch N-1 while it runs on device
+                output_ids = self.p_generate(
+                    freeze(self.params),
+                    batch.pop("input_features"),
+                    batch.pop("valid_rows"),
+                    batch.pop("force_token_array"),
+                    batch.pop("timestamp_rows"),
+                ).sequences
+                if pending is not None:
+                    model_outputs.append(fetch(*pending))
+                pending = (batch, output_ids)
+        finally:
+            # stops the prefetch worker if the generation raised
+            batches.close()
+
+        if pending is not None:
+            model_outputs.append(fetch(*pending))
+        return model_outputs
+
     def __call__(
         self,
         inputs,
@@ -429,6 +688,8 @@ class FlaxWhisperPipline:
         task=None,
         return_timestamps=None,
         generate_kwargs=None,
+        prefetch_size=0,
+        whole_file_log_mel=False,
     ):
         """
         Transcribe an audio input sequence to a text transcription, optionally with timestamps.
@@ -475,6 +736,21 @@ class FlaxWhisperPipline:
                 Whether to return timestamps in the prediction. Defaults to False. If set to true, the pipeline
                 will return two keys in the output dictionary: `"text"` containing the text transcription, and `"chunks"`
                 containing the transcription segments chunked by their utterance-level timestamps.
+            prefetch_size (`int`, *optional*, defaults to 0):
+                The number of batches to prepare ahead of the batch currently running on device. If greater than 0, the
+                feature extraction and host-to-device transfer of the next batches run in a background thread, and the
+                generated tokens of each batch are gathered while the following batch is being generated, such that
+                the devices are kept busy during pre-processing. The tokens are still detokenized after the last
+                batch, since the strided chunks are merged on token ids. The transcriptions are identical to the ones
+                obtained without prefetching.
+            whole_file_log_mel (`bool`, *optional*, defaults to `False`):
+                Whether to compute the log-mel spectrogram of the whole input once and slice the features of each
+                chunk from it, instead of running the feature extractor on every (overlapping) chunk. This avoids
+                re-computing the STFT of the stride regions, at the cost of holding the log-mel of the whole input in
+                host memory. Each chunk is still normalised independently, so the features only differ from the
+                per-chunk ones on the frames within `n_fft // 2` samples of a chunk boundary, which see the
+                neighbouring audio instead of reflect padding. Requires `chunk_length_s` to be 30s and the chunk step
+                to be a multiple of the hop length, otherwise falls back to the per-chunk computation.
 
         Return:
             `Dict`: A dictionary with the following keys:
@@ -492,8 +768,142 @@ class FlaxWhisperPipline:
             )
 
         dataloader = self.preprocess_batch(
-            inputs, chunk_length_s=chunk_length_s, stride_length_s=stride_length_s, batch_size=batch_size
+            inputs,
+            chunk_length_s=chunk_length_s,
+            stride_length_s=stride_length_s,
+            batch_size=batch_size,
+            whole_file_log_mel=whole_file_log_mel,
         )
+        model_outputs = self._forward_batches(
+            dataloader,
+            batch_size,
+            prefetch_size=prefetch_size,
+            language=language,
+            task=task,
+            return_timestamps=return_timestamps,
+        )
+        post_processed = self.postprocess(model_outputs, return_timestamps=return_timestamps)
+        return post_processed
+
+    def transcribe_many(
+        self,
+        inputs,
+        chunk_length_s=30.0,
+        stride_length_s=None,
+        batch_size=None,
+        language=None,
+        task=None,
+        return_timestamps=None,
+        prefetch_size=0,
+        whole_file_log_mel=False,
+    ):
+        """
+        Transcribe several audio inputs, packing the chunks of all inputs into shared batches. When calling the
+        pipeline on each input separately, the last batch of every input is padded up to `batch_size`, which wastes
+        most of the device compute for inputs shorter than `batch_size` chunks. Here, chunks from consecutive inputs
+        fill the same batch, so only the very last batch is padded. The generated tokens are routed back to their input
+        before the stride merging of [`~FlaxWhisperPipline.postprocess`], so each result is the same as the one of
+        [`~FlaxWhisperPipline.__call__`] for that input.
+
+        Args:
+            inputs (`Iterable`):
+                The audio inputs, each in any of the formats accepted by [`~FlaxWhisperPipline.__call__`]. Can be a
+                generator: inputs are read and pre-processed lazily, as the batches get filled.
+
+            language (`str` or `List[str]`, *optional*):
+                The language of all the inputs, or a list with the language of each input.
+            task (`str` or `List[str]`, *optional*):
+                The task for all the inputs, or a list with the task of each input.
+            return_timestamps (`bool` or `List[bool]`, *optional*):
+                Whether to return timestamps for all the inputs, or a list with one value per input.
+
+            All other arguments are the same as for [`~FlaxWhisperPipline.__call__`], and apply to all the inputs.
+            Inputs with different languages, tasks and timestamp settings are still packed into the same batches.
+
+        Return:
+            `List[Dict]`: The transcription of each input, in the order of `inputs`, in the format returned by
+            [`~FlaxWhisperPipline.__call__`].
+        """
+        batch_size = batch_size if batch_size is not None else self.batch_size
+        if batch_size % self.min_batch_size != 0:
+            raise ValueError(
+                f"Batch size must be a multiple of the number of JAX devices, but got batch size {batch_size} and num devices {self.min_batch_size}."
+            )
+
+        # index of the input each row of the packed batches belongs to, filled as the batches get built
+        batch_input_idx = []
+        num_inputs = 0
+
+        def input_setting(value, input_idx):
+            # settings given per input are lists, the ones shared by all inputs single values
+            return value[input_idx] if isinstance(value, (list, tuple)) else value
+
+        def chunks():
+            nonlocal num_inputs
+            for input_idx, audio in enumerate(inputs):
+                num_inputs += 1
+                settings = tuple(input_setting(value, input_idx) for value in (language, task, return_timestamps))
+                for batch in self.preprocess_batch(
+                    audio,
+                    chunk_length_s=chunk_length_s,
+                    stride_length_s=stride_length_s,
+                    batch_size=batch_size,
+                    whole_file_log_mel=whole_file_log_mel,
+                ):
+                    stride = batch.get("stride", None)
+                    for i, input_features in enumerate(batch["input_features"]):
+                        # without chunking, the stride (if any) is a single tuple for the whole input
+                        yield input_idx, settings, input_features, stride[i] if isinstance(stride, list) else stride
+
+        def packed_batches():
+            rows = []
+            for row in chunks():
+                rows.append(row)
+                if len(rows) == batch_size:
+                    yield pack(rows)
+                    rows = []
+            if rows:
+                yield pack(rows)
+
+        def pack(rows):
+            input_idx, settings, input_features, strides = zip(*rows)
+            batch_input_idx.append(input_idx)
+            batch = {"input_features": np.stack(input_features)}
+            # per-row generation settings, read by `forward` / the prefetch worker
+            batch["language"], batch["task"], batch["return_timestamps"] = (list(values) for values in zip(*settings))
+            if any(stride is not None for stride in strides):
+                batch["stride"] = list(strides)
+            return batch
+
+        model_outputs = self._forward_batches(packed_batches(), batch_size, prefetch_size=prefetch_size)
+
+        # route the generated tokens of each row back to its input
+        input_outputs = [[] for _ in range(num_inputs)]
+        for input_idx, output in zip(batch_input_idx, model_outputs):
+            for i, idx in enumerate(input_idx):
+                row = {"tokens": output["tokens"][i : i + 1]}
+                if output.get("stride") is not None and output["stride"][i] is not None:
+                    row["stride"] = [output["stride"][i]]
+                input_outputs[idx].append(row)
+
+        return [
+            self.postprocess(outputs, return_timestamps=input_setting(return_timestamps, input_idx))
+            for input_idx, outputs in enumerate(input_outputs)
+        ]
+
+    def _forward_batches(
+        self, dataloader, batch_size, prefetch_size=0, language=None, task=None, return_timestamps=False
+    ):
+        if prefetch_size > 0:
+            return self._prefetch_forward(
+                dataloader,
+                batch_size,
+                prefetch_size,
+                language=language,
+                task=task,
+                return_timestamps=return_timestamps,
+            )
+
         model_outputs = []
         # iterate over our chunked audio samples
         for batch in dataloader:
@@ -502,5 +912,4 @@ class FlaxWhisperPipline:
                     batch, batch_size=batch_size, language=language, task=task, return_timestamps=return_timestamps
                 )
             )
-        post_processed = self.postprocess(model_outputs, return_timestamps=return_timestamps)
-        return post_processed
+        return model_outputs